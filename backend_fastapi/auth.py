@@ -1,19 +1,49 @@
 import os
+import hashlib
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
+from cachetools import TTLCache
+import jwt
+from jwt import InvalidTokenError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from database import get_db
 from models import User
 
 SECRET_KEY = os.getenv("JWT_SECRET", "change-this-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+JWT_CACHE_TTL = 10  # seconds a verified token is trusted without re-checking
+USER_CACHE_TTL = 30  # seconds get_current_user reuses a user row without re-reading it
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use argon2; existing bcrypt hashes still verify and are upgraded on login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
 security = HTTPBearer()
+_DUMMY_HASH = pwd_context.hash("freecord-timing-dummy")
+
+# sha256(token) -> (payload, expires_at); only successful verifications are stored
+_jwt_cache: TTLCache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL)
+_jwt_cache_lock = threading.Lock()
+
+# user_id -> (display_name, avatar); cleared by the profile/avatar/status routes
+_user_profile_cache: TTLCache = TTLCache(maxsize=10000, ttl=60)
+_user_profile_lock = threading.Lock()
+# user_id -> detached User snapshot for get_current_user; dropped on every user write
+_user_cache: TTLCache = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL)
+_user_cache_lock = threading.Lock()
+_USER_COLUMNS = tuple(attr.key for attr in sa_inspect(User).column_attrs)
+# user_id -> bumped on every profile change, so long-lived holders can tell they're stale
+_profile_versions: dict[int, int] = {}
 
 
 def hash_password(password: str) -> str:
@@ -24,12 +54,80 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 
+def verify_and_update_password(plain: str, hashed: str | None) -> tuple[bool, str | None]:
+    """Verify a password, returning (valid, new_hash_if_rehash_needed).
+
+    A missing hash (unknown user) is checked against a dummy hash so the
+    response time doesn't reveal whether the username exists.
+    """
+    if hashed is None:
+        pwd_context.verify(plain, _DUMMY_HASH)
+        return False, None
+    return pwd_context.verify_and_update(plain, hashed)
+
+
 def create_access_token(user_id: int, username: str) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     payload = {"sub": str(user_id), "username": username, "exp": expire}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def verify_jwt_cached(token: str) -> dict:
+    """Decode a JWT, reusing recent successful verifications of the same token."""
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(key)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    # Never trust a cached token past its own expiry
+    expires_at = min(float(payload.get("exp", now)), now + JWT_CACHE_TTL)
+    if expires_at > now:
+        with _jwt_cache_lock:
+            _jwt_cache[key] = (payload, expires_at)
+    return payload
+
+
+def get_profile_lite(db: Session, user_id: int) -> tuple[str | None, str | None]:
+    """Return (display_name, avatar) for a user, cached for a short TTL."""
+    with _user_profile_lock:
+        cached = _user_profile_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    row = db.query(User.display_name, User.avatar).filter(User.id == user_id).first()
+    profile = (row.display_name, row.avatar) if row else (None, None)
+    with _user_profile_lock:
+        _user_profile_cache[user_id] = profile
+    return profile
+
+
+def invalidate_profile_cache(user_id: int):
+    with _user_profile_lock:
+        _user_profile_cache.pop(user_id, None)
+        _profile_versions[user_id] = _profile_versions.get(user_id, 0) + 1
+    forget_user(user_id)
+
+
+def forget_user(user_id: int):
+    """Drop the cached user row after writing to it outside a profile change."""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def _user_snapshot(user: User) -> User:
+    """Column-only detached copy of a loaded user, safe to merge into other sessions."""
+    snapshot = User(**{key: getattr(user, key) for key in _USER_COLUMNS})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def profile_version(user_id: int) -> int:
+    return _profile_versions.get(user_id, 0)
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db),
@@ -37,15 +135,24 @@ def get_current_user(
     """Extract and validate the JWT, return the User object."""
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = verify_jwt_cached(token)
         user_id = int(payload.get("sub"))
-    except (JWTError, ValueError, TypeError):
+    except (InvalidTokenError, ValueError, TypeError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
 
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached is not None:
+        # Attach a copy to this request's session without a SELECT; the snapshot stays unbound
+        return db.merge(cached, load=False)
+
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    snapshot = _user_snapshot(user)
+    with _user_cache_lock:
+        _user_cache[user_id] = snapshot
     return user
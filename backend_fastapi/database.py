@@ -1,12 +1,67 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.orm import sessionmaker, declarative_base, raiseload
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./Freecord.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./Freecord.db"
+
+# Compiled-SQL cache entries per engine (SQLAlchemy default 500). Eager-load and
+# raiseload options multiply the distinct statement shapes across the routes.
+QUERY_CACHE_SIZE = 1200
+# Seconds a request waits for a pooled connection before failing with 503 (main.py)
+POOL_TIMEOUT = 2
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    query_cache_size=QUERY_CACHE_SIZE,
+    pool_timeout=POOL_TIMEOUT,
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    """WAL lets readers run alongside the single writer instead of hitting 'database is locked'.
+
+    busy_timeout is the only lock wait: it overrides the driver's own timeout argument.
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+# Async engine on the same file, for routes that shouldn't tie up a threadpool worker.
+# aiosqlite defaults to NullPool (a fresh connection per session, no bound); a queue
+# pool reuses connections and sheds load with the same POOL_TIMEOUT / 503 as the sync engine.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    query_cache_size=QUERY_CACHE_SIZE,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_timeout=POOL_TIMEOUT,
 )
+event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+
+# Dev/CI: STRICT_LOADING=1 makes any relationship not eagerly loaded raise instead of lazy-loading
+STRICT_LOADING = os.getenv("STRICT_LOADING") == "1"
+
+
+def strict_loads(*options):
+    """Loader options for a list query, plus raiseload('*') when STRICT_LOADING is on."""
+    if STRICT_LOADING:
+        return (*options, raiseload("*"))
+    return options
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attribute access after commit can't lazy-load in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
 Base = declarative_base()
 
 
@@ -17,3 +72,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency: yields an AsyncSession, closes it after request."""
+    async with AsyncSessionLocal() as db:
+        yield db
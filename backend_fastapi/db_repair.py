@@ -0,0 +1,183 @@
+"""Startup repairs for rows written before the unique indexes existed.
+
+Older code checked for an existing row and then inserted, so a race could store
+duplicates that a unique index added later refuses to build over. Each step here
+folds such rows together; main.py runs them before creating missing indexes.
+"""
+
+import logging
+from collections import defaultdict
+
+from sqlalchemy import select, insert, update, delete, func, exists
+from sqlalchemy.orm import aliased
+
+from database import engine
+from models import Conversation, DirectMessage, DmReadState, DmSearchToken, PinnedMessage, FriendRequest
+from routes.dm_routes import dm_decrypt_many, dm_encrypt_many, dm_search_hashes
+
+logger = logging.getLogger("freecord")
+
+# Messages moved between conversations per encryption service call
+REPAIR_BATCH = 500
+
+
+async def merge_duplicate_conversations():
+    """Fold duplicate conversations for a pair into the oldest, then store every pair low id first.
+
+    DMs are encrypted per conversation, so the moved messages are re-encrypted (and
+    re-indexed) under the kept conversation. A duplicate that can't be re-encrypted
+    is logged and left alone; its unique index is then skipped for this startup.
+    """
+    low = func.min(Conversation.user1_id, Conversation.user2_id)
+    high = func.max(Conversation.user1_id, Conversation.user2_id)
+    with engine.connect() as conn:
+        groups = conn.execute(
+            select(func.group_concat(Conversation.id)).group_by(low, high).having(func.count() > 1)
+        ).scalars().all()
+
+    for ids in groups:
+        keeper, *duplicates = sorted(int(i) for i in ids.split(","))
+        for duplicate in duplicates:
+            try:
+                await _merge_conversation(duplicate, keeper)
+            except Exception:
+                logger.exception("Could not merge duplicate conversation %d into %d", duplicate, keeper)
+
+    # Legacy rows stored the pair in either order; _find_conversation only looks up low id first.
+    # A reversed row whose pair still exists the other way round is a duplicate that didn't merge.
+    mirror = aliased(Conversation)
+    with engine.begin() as conn:
+        conn.execute(
+            update(Conversation)
+            .where(
+                Conversation.user1_id > Conversation.user2_id,
+                ~exists().where(
+                    mirror.user1_id == Conversation.user2_id, mirror.user2_id == Conversation.user1_id
+                ),
+            )
+            .values(user1_id=Conversation.user2_id, user2_id=Conversation.user1_id)
+        )
+
+
+async def _merge_conversation(duplicate: int, keeper: int):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(DirectMessage.id, DirectMessage.encrypted_content)
+            .where(DirectMessage.conversation_id == duplicate, DirectMessage.encrypted_content != "")
+        ).all()
+
+    # Decrypt and re-encrypt everything before writing, so a service error changes nothing
+    moved = []
+    for start in range(0, len(rows), REPAIR_BATCH):
+        batch = rows[start:start + REPAIR_BATCH]
+        plaintexts = await dm_decrypt_many(duplicate, [r.encrypted_content for r in batch])
+        if any(p is None for p in plaintexts):
+            raise RuntimeError(f"conversation {duplicate} has messages that could not be decrypted")
+        encrypted = await dm_encrypt_many(keeper, plaintexts)
+        moved.extend(zip((r.id for r in batch), plaintexts, encrypted))
+
+    with engine.begin() as conn:
+        message_ids = select(DirectMessage.id).where(DirectMessage.conversation_id == duplicate)
+        # Search tokens are keyed by conversation; rebuild them for the moved messages
+        conn.execute(delete(DmSearchToken).where(DmSearchToken.dm_message_id.in_(message_ids)))
+        for msg_id, plaintext, ciphertext in moved:
+            conn.execute(
+                update(DirectMessage).where(DirectMessage.id == msg_id).values(encrypted_content=ciphertext)
+            )
+        token_rows = [
+            {"dm_message_id": msg_id, "token_hash": h}
+            for msg_id, plaintext, _ in moved
+            for h in dm_search_hashes(keeper, plaintext)
+        ]
+        if token_rows:
+            conn.execute(insert(DmSearchToken), token_rows)
+        conn.execute(
+            update(DirectMessage).where(DirectMessage.conversation_id == duplicate).values(conversation_id=keeper)
+        )
+        conn.execute(
+            update(PinnedMessage).where(PinnedMessage.conversation_id == duplicate).values(conversation_id=keeper)
+        )
+
+        # One read state per user: keep the later of the two timestamps
+        states = defaultdict(list)
+        for state_id, user_id, last_read_at in conn.execute(
+            select(DmReadState.id, DmReadState.user_id, DmReadState.last_read_at)
+            .where(DmReadState.conversation_id.in_((keeper, duplicate)))
+        ):
+            states[user_id].append((state_id, last_read_at))
+        for user_id, entries in states.items():
+            (kept_id, _), *extra = entries
+            last_read_at = max((t for _, t in entries if t is not None), default=None)
+            if extra:
+                conn.execute(delete(DmReadState).where(DmReadState.id.in_([i for i, _ in extra])))
+            conn.execute(
+                update(DmReadState).where(DmReadState.id == kept_id)
+                .values(conversation_id=keeper, last_read_at=last_read_at)
+            )
+
+        conn.execute(delete(Conversation).where(Conversation.id == duplicate))
+    logger.warning("Merged duplicate conversation %d into %d (%d messages moved)", duplicate, keeper, len(moved))
+
+
+def dedupe_dm_pins():
+    """Drop repeat pins of the same DM left by the old racy pin_dm_message (ix_pin_convo_msg)."""
+    first_pins = (
+        select(func.min(PinnedMessage.id))
+        .where(PinnedMessage.conversation_id.is_not(None))
+        .group_by(PinnedMessage.conversation_id, PinnedMessage.dm_message_id)
+    )
+    with engine.begin() as conn:
+        removed = conn.execute(
+            delete(PinnedMessage)
+            .where(PinnedMessage.conversation_id.is_not(None), PinnedMessage.id.not_in(first_pins))
+        ).rowcount
+    if removed:
+        logger.warning("Removed %d duplicate DM pins", removed)
+
+
+def dedupe_pending_friend_requests():
+    """Deny all but the newest pending request per pair, left by the old SELECT-then-INSERT race.
+
+    uq_friend_requests_pending_pair only covers pending rows, so denied ones can stay.
+    """
+    newest = (
+        select(func.max(FriendRequest.id))
+        .where(FriendRequest.status == "pending")
+        .group_by(FriendRequest.sender_id, FriendRequest.receiver_id)
+    )
+    with engine.begin() as conn:
+        denied = conn.execute(
+            update(FriendRequest)
+            .where(FriendRequest.status == "pending", FriendRequest.id.not_in(newest))
+            .values(status="denied")
+        ).rowcount
+    if denied:
+        logger.warning("Denied %d duplicate pending friend requests", denied)
+
+
+def reset_dm_search_index():
+    """Drop every DM search token, after SEARCH_INDEX_KEY changes.
+
+    Search treats messages without tokens as unindexed and decrypts them to match,
+    so nothing goes missing; new and edited messages are indexed under the new key.
+    """
+    with engine.begin() as conn:
+        removed = conn.execute(delete(DmSearchToken)).rowcount
+    logger.warning("Removed %d DM search tokens", removed)
+
+
+async def repair_legacy_rows():
+    """Run every repair step; each is a no-op once the data is clean."""
+    await merge_duplicate_conversations()
+    dedupe_dm_pins()
+    dedupe_pending_friend_requests()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["reset-search-index"]:
+        logging.basicConfig(level=logging.INFO)
+        reset_dm_search_index()
+    else:
+        sys.exit("usage: python db_repair.py reset-search-index")
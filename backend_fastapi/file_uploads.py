@@ -0,0 +1,50 @@
+"""Attachment checks and disk writes shared by channel and DM uploads."""
+
+import os
+import re
+
+from fastapi import HTTPException
+
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ALLOWED_EXTENSIONS = frozenset({
+    "png", "jpg", "jpeg", "gif", "webp", "svg",
+    "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx",
+    "txt", "csv", "json", "xml",
+    "zip", "tar", "gz", "rar", "7z",
+    "mp3", "wav", "ogg", "mp4", "webm", "mov",
+})
+# No path separators, and a final .ext to check against ALLOWED_EXTENSIONS
+_FILENAME_RE = re.compile(r"[^/\\]*\.([A-Za-z0-9]+)")
+
+
+def validate_filename(filename: str) -> str:
+    """Reject unsafe names and disallowed types; returns the lowercase extension.
+
+    Size is checked by write_upload while the file streams to disk.
+    """
+    m = _FILENAME_RE.fullmatch(filename)
+    if not m or ".." in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    ext = m.group(1).lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"File type .{ext} not allowed")
+    return ext
+
+
+def write_upload(src, path: str) -> int:
+    """Copy an upload to path in chunks, so it never sits fully in memory; returns its size.
+
+    Blocking: run it in a worker thread. An upload over MAX_FILE_SIZE is removed and rejected.
+    """
+    total = 0
+    with open(path, "wb") as f:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > MAX_FILE_SIZE:
+                break
+            f.write(chunk)
+    if total > MAX_FILE_SIZE:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail="File must be under 10MB")
+    return total
@@ -1,23 +1,38 @@
 import os
-import json
+import time
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from jose import JWTError, jwt
-
-from database import engine, Base, SessionLocal
-from ws_manager import manager, dm_manager, connected_users
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+import orjson
+from jwt import InvalidTokenError
+
+from auth import verify_jwt_cached, get_profile_lite, profile_version, forget_user
+from database import engine, async_engine, Base, SessionLocal
+from db_repair import repair_legacy_rows
+from models import User, Message, Conversation, DirectMessage, DmSearchToken
+from ws_manager import (
+    manager, dm_manager, connected_users, last_status, register_user_socket, unregister_user_socket,
+    send_to_socket, start_bus, stop_bus,
+)
 from routes.auth_routes import router as auth_router
 from routes.server_routes import router as server_router
 from routes.channel_routes import router as channel_router
-from routes.message_routes import router as message_router, encrypt_message
-from routes.dm_routes import router as dm_router, dm_encrypt, DM_KEY_OFFSET
+from routes.message_routes import (
+    router as message_router, encrypt_messages_batch, encrypt_batcher, rust_client as message_rust_client,
+)
+from routes.dm_routes import router as dm_router, dm_encrypt_many, dm_search_hashes, rust_client as dm_rust_client
 from routes.friend_routes import router as friend_router
 from routes.invite_routes import router as invite_router
 from routes.notification_routes import router as notification_router
@@ -25,6 +40,7 @@ from routes.moderation_routes import router as moderation_router
 
 
 BASE_DIR = os.path.dirname(__file__)
+logger = logging.getLogger("freecord")
 
 # Ensure upload directories exist before StaticFiles mounts
 os.makedirs(os.path.join(BASE_DIR, "uploads", "channels"), exist_ok=True)
@@ -37,9 +53,36 @@ os.makedirs(os.path.join(BASE_DIR, "avatars"), exist_ok=True)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     Base.metadata.create_all(bind=engine)
+    # Fold rows that older, racier code duplicated, so the unique indexes below can build
+    await repair_legacy_rows()
+    # create_all skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError:
+                # A duplicate the repair couldn't fold; serve without the index rather than not start
+                logger.error("Skipping unique index %s: existing rows violate it", index.name)
+    # Refresh planner stats so SQLite picks between the overlapping composite indexes
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+    encrypt_batcher.start()
+    await start_bus()
     yield
+    await stop_bus()
+    await encrypt_batcher.stop()
+    await message_rust_client.aclose()
+    await dm_rust_client.aclose()
+    await async_engine.dispose()
+
+app = FastAPI(title="Freecord API", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """Every pooled connection stayed busy for POOL_TIMEOUT; shed load instead of queueing."""
+    return ORJSONResponse({"detail": "Server busy, try again"}, status_code=503, headers={"Retry-After": "1"})
 
-app = FastAPI(title="Freecord API", lifespan=lifespan)
 
 # CORS — allow the Flask frontend
 app.add_middleware(
@@ -48,13 +91,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Page cursor for message and notification lists
+    expose_headers=["X-Next-Cursor"],
 )
 
 # ── Serve static files ──
+class ImmutableStaticFiles(StaticFiles):
+    """Uploads get random names and are never rewritten, so clients can cache them for good."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 app.mount("/avatars", StaticFiles(directory=os.path.join(BASE_DIR, "avatars")), name="avatars")
 app.mount("/attachments", StaticFiles(directory=os.path.join(BASE_DIR, "attachments")), name="attachments")
-app.mount("/uploads/channels", StaticFiles(directory=os.path.join(BASE_DIR, "uploads", "channels")), name="uploads_channels")
-app.mount("/uploads/dms", StaticFiles(directory=os.path.join(BASE_DIR, "uploads", "dms")), name="uploads_dms")
+app.mount("/uploads/channels", ImmutableStaticFiles(directory=os.path.join(BASE_DIR, "uploads", "channels")), name="uploads_channels")
+app.mount("/uploads/dms", ImmutableStaticFiles(directory=os.path.join(BASE_DIR, "uploads", "dms")), name="uploads_dms")
 
 # ── Register routers ──
 app.include_router(auth_router)
@@ -68,19 +122,138 @@ app.include_router(notification_router)
 app.include_router(moderation_router)
 
 
-JWT_SECRET = os.getenv("JWT_SECRET", "change-this-secret-key")
-
-
 def _update_user_status(user_id: int, status: str):
     """Update user status in database."""
+    with SessionLocal() as db:
+        db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(status=status, last_activity=datetime.now(timezone.utc))
+        )
+        db.commit()
+    forget_user(user_id)
+
+
+# Reconnects that don't change status refresh last_activity at most this often
+ACTIVITY_DEBOUNCE = 30.0  # seconds
+_last_activity_write: dict[int, float] = {}
+
+
+async def _set_user_status(user_id: int, status: str) -> bool:
+    """Persist a status off the event loop; returns True only if the status changed."""
+    changed = last_status.get(user_id) != status
+    now = time.monotonic()
+    if not changed and now - _last_activity_write.get(user_id, 0.0) < ACTIVITY_DEBOUNCE:
+        return False
+    last_status[user_id] = status
+    _last_activity_write[user_id] = now
+    await asyncio.to_thread(_update_user_status, user_id, status)
+    return changed
+
+
+def _load_user_profile(user_id: int) -> tuple[str | None, str | None]:
+    """Return (display_name, avatar_url) for a message sender. Blocking."""
+    with SessionLocal() as db:
+        display_name, avatar = get_profile_lite(db, user_id)
+    return display_name, f"/avatars/{avatar}" if avatar else None
+
+
+def _profile_loader(user_id: int):
+    """Per-connection sender profile, reloaded only after the user edits their profile."""
+    state = {"version": None, "profile": (None, None)}
+
+    async def load() -> tuple[str | None, str | None]:
+        version = profile_version(user_id)
+        if state["version"] != version:
+            state["profile"] = await asyncio.to_thread(_load_user_profile, user_id)
+            state["version"] = version
+        return state["profile"]
+
+    return load
+
+
+def _persist_channel_messages(db: Session, channel_id: int, user_id: int, encrypted: list[str]):
+    """Store a batch of channel messages with one Core INSERT ... RETURNING.
+
+    Returns [(id, created_at), ...].
+    Blocking — call via asyncio.to_thread from WebSocket handlers.
+    """
+    try:
+        table = Message.__table__
+        result = db.execute(
+            insert(table).returning(table.c.id, table.c.created_at, sort_by_parameter_order=True),
+            [{"encrypted_content": e, "channel_id": channel_id, "user_id": user_id} for e in encrypted],
+        )
+        rows = [(msg_id, created_at.isoformat()) for msg_id, created_at in result]
+        db.commit()
+        return rows
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _persist_dm_messages(
+    db: Session, conversation_id: int, user_id: int, encrypted: list[str], contents: list[str]
+):
+    """Store a batch of DMs (and their search tokens) with Core INSERT ... RETURNING.
+
+    Returns [(id, created_at), ...].
+    Blocking — call via asyncio.to_thread from WebSocket handlers.
+    """
+    try:
+        table = DirectMessage.__table__
+        result = db.execute(
+            insert(table).returning(table.c.id, table.c.created_at, sort_by_parameter_order=True),
+            [{"encrypted_content": e, "conversation_id": conversation_id, "sender_id": user_id} for e in encrypted],
+        )
+        rows = [(msg_id, created_at.isoformat()) for msg_id, created_at in result]
+        token_rows = [
+            {"dm_message_id": msg_id, "token_hash": h}
+            for (msg_id, _), content in zip(rows, contents)
+            for h in dm_search_hashes(conversation_id, content)
+        ]
+        if token_rows:
+            db.execute(insert(DmSearchToken), token_rows)
+        db.commit()
+        return rows
+    except Exception:
+        db.rollback()
+        raise
+
+
+# Messages arriving within this window of each other share one commit
+WS_BATCH_WINDOW = 0.01
+WS_BATCH_MAX = 50
+
+
+async def _message_writer(queue: asyncio.Queue, flush, websocket: WebSocket):
+    """Drain a socket's outgoing messages in batches until a None sentinel arrives.
+
+    One Session serves the whole connection; it only holds a pooled
+    connection while a batch is being committed. A batch that fails to store
+    is logged and reported to the sender, and the writer moves on to the next.
+    """
     db = SessionLocal()
     try:
-        from models import User
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            user.status = status
-            user.last_activity = datetime.now(timezone.utc)
-            db.commit()
+        while True:
+            batch = [await queue.get()]
+            try:
+                while batch[-1] is not None and len(batch) < WS_BATCH_MAX:
+                    batch.append(await asyncio.wait_for(queue.get(), WS_BATCH_WINDOW))
+            except asyncio.TimeoutError:
+                pass
+            contents = [c for c in batch if c is not None]
+            if contents:
+                try:
+                    await flush(db, contents)
+                except Exception:
+                    logger.exception("Failed to store %d WebSocket message(s)", len(contents))
+                    send_to_socket(websocket, orjson.dumps({
+                        "type": "error",
+                        "detail": f"{len(contents)} message(s) could not be sent",
+                    }).decode())
+            if batch[-1] is None:
+                return
     finally:
         db.close()
 
@@ -89,67 +262,35 @@ def _update_user_status(user_id: int, status: str):
 async def websocket_endpoint(websocket: WebSocket, channel_id: int, token: str = Query(...)):
     # Authenticate the WebSocket connection via JWT
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = int(payload["sub"])
         username = payload["username"]
-    except (JWTError, KeyError, ValueError):
+    except (InvalidTokenError, KeyError, ValueError):
         await websocket.close(code=4001, reason="Unauthorized")
         return
 
+    # Presence frames only vary by status for this connection, so encode them once
+    status_payloads = {
+        st: orjson.dumps({"type": "status_update", "user_id": user_id, "username": username, "status": st}).decode()
+        for st in ("online", "offline")
+    }
     await manager.connect(websocket, channel_id, user_id, username)
-    connected_users[user_id].add(websocket)
+    register_user_socket(user_id, websocket)
+    sender_profile = _profile_loader(user_id)
+    await sender_profile()
 
     # Set user online
-    _update_user_status(user_id, "online")
-    await manager.broadcast_except(channel_id, {
-        "type": "status_update",
-        "user_id": user_id,
-        "username": username,
-        "status": "online",
-    }, user_id)
-
-    try:
-        while True:
-            data = await websocket.receive_text()
-            msg_data = json.loads(data)
-            msg_type = msg_data.get("type", "message")
-
-            # ── Typing indicator ──
-            if msg_type in ("typing_start", "typing_stop"):
-                await manager.broadcast_except(channel_id, {
-                    "type": msg_type,
-                    "user_id": user_id,
-                    "username": username,
-                }, user_id)
-                continue
-
-            # ── Regular message ──
-            content = msg_data.get("content", "")
-            if not content.strip():
-                continue
-
-            from models import Message, User
-
-            encrypted = await encrypt_message(channel_id, content)
-            db = SessionLocal()
-            try:
-                msg = Message(
-                    encrypted_content=encrypted,
-                    channel_id=channel_id,
-                    user_id=user_id,
-                )
-                db.add(msg)
-                db.commit()
-                db.refresh(msg)
-                msg_id = msg.id
-                created_at = msg.created_at.isoformat()
-                sender = db.query(User).filter(User.id == user_id).first()
-                display_name = sender.display_name if sender else None
-                avatar_url = f"/avatars/{sender.avatar}" if sender and sender.avatar else None
-            finally:
-                db.close()
-
-            await manager.broadcast(channel_id, {
+    if await _set_user_status(user_id, "online"):
+        await manager.broadcast_except_raw(channel_id, status_payloads["online"], user_id)
+
+    async def flush(db: Session, contents: list[str]):
+        encrypted = await encrypt_messages_batch(channel_id, contents)
+        rows = await asyncio.to_thread(
+            _persist_channel_messages, db, channel_id, user_id, encrypted
+        )
+        display_name, avatar_url = await sender_profile()
+        await manager.broadcast_many_raw(channel_id, [
+            orjson.dumps({
                 "type": "message",
                 "id": msg_id,
                 "content": content,
@@ -166,19 +307,52 @@ async def websocket_endpoint(websocket: WebSocket, channel_id: int, token: str =
                 "edited_at": None,
                 "reactions": [],
                 "created_at": created_at,
-            })
+            }).decode()
+            for content, (msg_id, created_at) in zip(contents, rows)
+        ])
+
+    queue: asyncio.Queue = asyncio.Queue()
+    writer = asyncio.create_task(_message_writer(queue, flush, websocket))
+    # Typing events only vary by type for this connection, so encode them once
+    typing_payloads = {
+        t: orjson.dumps({"type": t, "user_id": user_id, "username": username}).decode()
+        for t in ("typing_start", "typing_stop")
+    }
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            msg_data = orjson.loads(data)
+            msg_type = msg_data.get("type", "message")
+
+            # ── Typing indicator ──
+            if msg_type in ("typing_start", "typing_stop"):
+                if manager.allow_typing(channel_id, user_id, msg_type):
+                    await manager.broadcast_except_raw(channel_id, typing_payloads[msg_type], user_id)
+                continue
+
+            # ── Regular message ──
+            content = msg_data.get("content", "")
+            if not content.strip():
+                continue
+
+            if writer.done():
+                await writer  # re-raise whatever stopped the writer
+            queue.put_nowait(content)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Any exit (a disconnect, a malformed frame, a dead writer) releases the socket
         manager.disconnect(websocket, channel_id)
-        connected_users[user_id].discard(websocket)
+        manager.last_typing.pop((user_id, channel_id), None)
+        unregister_user_socket(user_id, websocket)
+        # Let the writer persist anything still queued before going offline;
+        # asyncio.wait neither cancels the writer nor re-raises its errors here
+        queue.put_nowait(None)
+        await asyncio.wait([writer])
         # Only set offline if no other connections remain
-        if not connected_users[user_id]:
-            _update_user_status(user_id, "offline")
-            await manager.broadcast(channel_id, {
-                "type": "status_update",
-                "user_id": user_id,
-                "username": username,
-                "status": "offline",
-            })
+        if not connected_users[user_id] and await _set_user_status(user_id, "offline"):
+            await manager.broadcast_raw(channel_id, status_payloads["offline"])
 
 
 # ── DM WebSocket ──
@@ -186,76 +360,44 @@ async def websocket_endpoint(websocket: WebSocket, channel_id: int, token: str =
 @app.websocket("/ws/dm/{conversation_id}")
 async def dm_websocket_endpoint(websocket: WebSocket, conversation_id: int, token: str = Query(...)):
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = int(payload["sub"])
         username = payload["username"]
-    except (JWTError, KeyError, ValueError):
+    except (InvalidTokenError, KeyError, ValueError):
         await websocket.close(code=4001, reason="Unauthorized")
         return
 
-    # Verify user is a participant in this conversation
-    from models import Conversation
-    db = SessionLocal()
-    convo = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    if not convo or user_id not in (convo.user1_id, convo.user2_id):
-        db.close()
+    # Verify user is a participant in this conversation; the session (and its
+    # connection) is gone before the socket is accepted
+    with SessionLocal() as db:
+        participants = db.query(Conversation.user1_id, Conversation.user2_id).filter(
+            Conversation.id == conversation_id
+        ).first()
+    if not participants or user_id not in participants:
         await websocket.close(code=4003, reason="Not a participant")
         return
-    db.close()
 
+    # Presence frames only vary by status for this connection, so encode them once
+    status_payloads = {
+        st: orjson.dumps({"type": "status_update", "user_id": user_id, "username": username, "status": st}).decode()
+        for st in ("online", "offline")
+    }
     await dm_manager.connect(websocket, conversation_id, user_id, username)
-    connected_users[user_id].add(websocket)
-
-    _update_user_status(user_id, "online")
-    await dm_manager.broadcast_except(conversation_id, {
-        "type": "status_update",
-        "user_id": user_id,
-        "username": username,
-        "status": "online",
-    }, user_id)
-
-    try:
-        while True:
-            data = await websocket.receive_text()
-            msg_data = json.loads(data)
-            msg_type = msg_data.get("type", "message")
-
-            # ── Typing indicator ──
-            if msg_type in ("typing_start", "typing_stop"):
-                await dm_manager.broadcast_except(conversation_id, {
-                    "type": msg_type,
-                    "user_id": user_id,
-                    "username": username,
-                }, user_id)
-                continue
-
-            # ── Regular message ──
-            content = msg_data.get("content", "")
-            if not content.strip():
-                continue
-
-            from models import DirectMessage, User
-
-            encrypted = await dm_encrypt(conversation_id, content)
-            db = SessionLocal()
-            try:
-                msg = DirectMessage(
-                    encrypted_content=encrypted,
-                    conversation_id=conversation_id,
-                    sender_id=user_id,
-                )
-                db.add(msg)
-                db.commit()
-                db.refresh(msg)
-                msg_id = msg.id
-                created_at = msg.created_at.isoformat()
-                sender = db.query(User).filter(User.id == user_id).first()
-                display_name = sender.display_name if sender else None
-                avatar_url = f"/avatars/{sender.avatar}" if sender and sender.avatar else None
-            finally:
-                db.close()
-
-            await dm_manager.broadcast(conversation_id, {
+    register_user_socket(user_id, websocket)
+    sender_profile = _profile_loader(user_id)
+    await sender_profile()
+
+    if await _set_user_status(user_id, "online"):
+        await dm_manager.broadcast_except_raw(conversation_id, status_payloads["online"], user_id)
+
+    async def flush(db: Session, contents: list[str]):
+        encrypted = await dm_encrypt_many(conversation_id, contents)
+        rows = await asyncio.to_thread(
+            _persist_dm_messages, db, conversation_id, user_id, encrypted, contents
+        )
+        display_name, avatar_url = await sender_profile()
+        await dm_manager.broadcast_many_raw(conversation_id, [
+            orjson.dumps({
                 "type": "message",
                 "id": msg_id,
                 "content": content,
@@ -272,18 +414,51 @@ async def dm_websocket_endpoint(websocket: WebSocket, conversation_id: int, toke
                 "edited_at": None,
                 "reactions": [],
                 "created_at": created_at,
-            })
+            }).decode()
+            for content, (msg_id, created_at) in zip(contents, rows)
+        ])
+
+    queue: asyncio.Queue = asyncio.Queue()
+    writer = asyncio.create_task(_message_writer(queue, flush, websocket))
+    # Typing events only vary by type for this connection, so encode them once
+    typing_payloads = {
+        t: orjson.dumps({"type": t, "user_id": user_id, "username": username}).decode()
+        for t in ("typing_start", "typing_stop")
+    }
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            msg_data = orjson.loads(data)
+            msg_type = msg_data.get("type", "message")
+
+            # ── Typing indicator ──
+            if msg_type in ("typing_start", "typing_stop"):
+                if dm_manager.allow_typing(conversation_id, user_id, msg_type):
+                    await dm_manager.broadcast_except_raw(conversation_id, typing_payloads[msg_type], user_id)
+                continue
+
+            # ── Regular message ──
+            content = msg_data.get("content", "")
+            if not content.strip():
+                continue
+
+            if writer.done():
+                await writer  # re-raise whatever stopped the writer
+            queue.put_nowait(content)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Any exit (a disconnect, a malformed frame, a dead writer) releases the socket
         dm_manager.disconnect(websocket, conversation_id)
-        connected_users[user_id].discard(websocket)
-        if not connected_users[user_id]:
-            _update_user_status(user_id, "offline")
-            await dm_manager.broadcast(conversation_id, {
-                "type": "status_update",
-                "user_id": user_id,
-                "username": username,
-                "status": "offline",
-            })
+        dm_manager.last_typing.pop((user_id, conversation_id), None)
+        unregister_user_socket(user_id, websocket)
+        # Let the writer persist anything still queued before going offline;
+        # asyncio.wait neither cancels the writer nor re-raises its errors here
+        queue.put_nowait(None)
+        await asyncio.wait([writer])
+        if not connected_users[user_id] and await _set_user_status(user_id, "offline"):
+            await dm_manager.broadcast_raw(conversation_id, status_payloads["offline"])
 
 
 # ── User Status endpoint ──
@@ -300,7 +475,7 @@ async def update_status(
 
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Securecord API is running"}
 
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Table, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from database import Base
@@ -60,15 +60,22 @@ class Message(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     encrypted_content = Column(String, nullable=False)  # stored encrypted
-    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     attachment = Column(String(255), nullable=True)     # filename in uploads/
     attachment_name = Column(String(255), nullable=True)  # original filename
     attachment_size = Column(Integer, nullable=True)      # file size in bytes
     attachment_mime = Column(String(128), nullable=True)  # MIME type
     is_deleted = Column(Boolean, default=False)
     edited_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+    __table_args__ = (
+        Index("ix_messages_channel_created", "channel_id", "created_at"),
+        # Search (live messages, newest first) and purge (one author's live messages)
+        Index("ix_messages_channel_deleted_created", "channel_id", "is_deleted", "created_at"),
+        Index("ix_messages_channel_user_deleted", "channel_id", "user_id", "is_deleted"),
+    )
 
     channel = relationship("Channel", back_populates="messages")
     user = relationship("User")
@@ -81,9 +88,14 @@ class Conversation(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    user2_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user2_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # New conversations store the lower user id first (see start_conversation)
+        Index("ix_conversations_users", "user1_id", "user2_id", unique=True),
+    )
+
     user1 = relationship("User", foreign_keys=[user1_id])
     user2 = relationship("User", foreign_keys=[user2_id])
     direct_messages = relationship("DirectMessage", back_populates="conversation", cascade="all, delete-orphan")
@@ -95,15 +107,20 @@ class DirectMessage(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     encrypted_content = Column(String, nullable=False)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
-    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False, index=True)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     attachment = Column(String(255), nullable=True)       # filename in uploads/
     attachment_name = Column(String(255), nullable=True)  # original filename
     attachment_size = Column(Integer, nullable=True)      # file size in bytes
     attachment_mime = Column(String(128), nullable=True)  # MIME type
     is_deleted = Column(Boolean, default=False)
     edited_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+    __table_args__ = (
+        Index("ix_direct_messages_conversation_created", "conversation_id", "created_at"),
+        Index("ix_direct_messages_conversation_deleted_created", "conversation_id", "is_deleted", "created_at"),
+    )
 
     conversation = relationship("Conversation", back_populates="direct_messages")
     sender = relationship("User")
@@ -116,12 +133,14 @@ class Reaction(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False, index=True)
     emoji = Column(String(32), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (
         UniqueConstraint("user_id", "message_id", "emoji", name="uq_reaction"),
+        # Per-emoji counts and grouping; uq_reaction leads with user_id so can't serve these
+        Index("ix_reactions_message_emoji", "message_id", "emoji"),
     )
 
     user = relationship("User")
@@ -134,7 +153,7 @@ class DMReaction(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    dm_message_id = Column(Integer, ForeignKey("direct_messages.id"), nullable=False)
+    dm_message_id = Column(Integer, ForeignKey("direct_messages.id"), nullable=False, index=True)
     emoji = Column(String(32), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
@@ -157,6 +176,16 @@ class FriendRequest(Base):
     status = Column(String(20), default="pending")  # pending, accepted, denied
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # Only pending requests are looked up per user; handled ones stay out of these indexes.
+        # The pair index also serves outgoing lists and stops duplicate pending requests.
+        Index("ix_friend_requests_pending_receiver", "receiver_id", sqlite_where=text("status = 'pending'")),
+        Index(
+            "uq_friend_requests_pending_pair", "sender_id", "receiver_id",
+            unique=True, sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
     sender = relationship("User", foreign_keys=[sender_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
@@ -194,6 +223,19 @@ class DmReadState(Base):
     conversation = relationship("Conversation")
 
 
+class DmSearchToken(Base):
+    """Blind index for DM search: one HMAC of each lowercase word in a message."""
+    __tablename__ = "dm_search_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dm_message_id = Column(Integer, ForeignKey("direct_messages.id"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False)
+
+    __table_args__ = (
+        Index("ix_dm_search_tokens_hash_message", "token_hash", "dm_message_id"),
+    )
+
+
 class BlockedUser(Base):
     __tablename__ = "blocked_users"
 
@@ -217,11 +259,16 @@ class PinnedMessage(Base):
     id = Column(Integer, primary_key=True, index=True)
     message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
     dm_message_id = Column(Integer, ForeignKey("direct_messages.id"), nullable=True)
-    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"), nullable=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True, index=True)
     pinned_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     pinned_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # Channel pins leave conversation_id NULL, and NULLs never collide in a unique index
+        Index("ix_pin_convo_msg", "conversation_id", "dm_message_id", unique=True),
+    )
+
     message = relationship("Message")
     dm_message = relationship("DirectMessage")
     pinner = relationship("User")
@@ -251,13 +298,18 @@ class Notification(Base):
     __tablename__ = "notifications"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     type = Column(String(30), nullable=False)  # friend_request, mention, invite
     reference_id = Column(Integer, nullable=True)
     content = Column(String(255), nullable=True)
     is_read = Column(Boolean, default=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        Index("ix_notifications_user_read", "user_id", "is_read"),
+        Index("ix_notifications_user_created", "user_id", "created_at"),
+    )
+
     user = relationship("User")
 
 
@@ -1,16 +1,27 @@
 import os
 import uuid
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import orjson
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response
 from sqlalchemy.orm import Session
 from database import get_db
 from models import User
 from schemas import UserCreate, UserLogin, UserOut, Token, ProfileUpdate, ProfileOut, StatusUpdate
-from auth import hash_password, verify_password, create_access_token, get_current_user
+from ws_manager import last_status
+from auth import (
+    hash_password, verify_and_update_password, create_access_token, get_current_user,
+    invalidate_profile_cache, profile_version,
+)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 AVATARS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "avatars")
+MAX_AVATAR_SIZE = 10 * 1024 * 1024  # 10MB
+AVATAR_CHUNK_SIZE = 64 * 1024
+
+# user_id -> (cache key, encoded ProfileOut JSON) for GET /auth/profile
+_profile_json_cache: TTLCache = TTLCache(maxsize=10000, ttl=300)
 
 
 def _avatar_url(user: User) -> str | None:
@@ -49,16 +60,26 @@ def register(data: UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=Token)
 def login(data: UserLogin, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == data.username).first()
-    if not user or not verify_password(data.password, user.hashed_password):
+    valid, new_hash = verify_and_update_password(data.password, user.hashed_password if user else None)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
 
     token = create_access_token(user.id, user.username)
     return Token(access_token=token)
 
 
 @router.get("/profile", response_model=ProfileOut)
-def get_profile(user: User = Depends(get_current_user)):
-    return _profile_out(user)
+async def get_profile(user: User = Depends(get_current_user)):
+    # Serve pre-encoded JSON; profile edits bump the version, presence changes status/last_activity
+    key = (profile_version(user.id), user.status, user.last_activity)
+    cached = _profile_json_cache.get(user.id)
+    if cached is None or cached[0] != key:
+        cached = (key, orjson.dumps(_profile_out(user).model_dump()))
+        _profile_json_cache[user.id] = cached
+    return Response(content=cached[1], media_type="application/json")
 
 
 @router.put("/profile", response_model=ProfileOut)
@@ -70,6 +91,7 @@ def update_profile(
     if data.display_name is not None:
         user.display_name = data.display_name.strip() or None
     db.commit()
+    invalidate_profile_cache(user.id)
     db.refresh(user)
     return _profile_out(user)
 
@@ -88,6 +110,8 @@ def update_status(
         user.custom_status_text = data.custom_status_text.strip() or None
     user.last_activity = datetime.now(timezone.utc)
     db.commit()
+    invalidate_profile_cache(user.id)
+    last_status[user.id] = user.status
     db.refresh(user)
     return _profile_out(user)
 
@@ -102,23 +126,29 @@ def upload_avatar(
     if file.content_type not in allowed:
         raise HTTPException(status_code=400, detail="Only PNG, JPEG, GIF, or WebP images allowed")
 
-    contents = file.file.read()
-    if len(contents) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Image must be under 10MB")
-
-    if user.avatar:
-        old_path = os.path.join(AVATARS_DIR, user.avatar)
-        if os.path.exists(old_path):
-            os.remove(old_path)
-
     ext = file.filename.rsplit(".", 1)[-1] if "." in file.filename else "png"
     filename = f"{user.id}_{uuid.uuid4().hex[:8]}.{ext}"
     filepath = os.path.join(AVATARS_DIR, filename)
 
+    # Stream to disk in chunks so a large upload never sits fully in memory.
+    # Sync handler: the file copy and the commit run in the threadpool, off the event loop.
+    total = 0
     with open(filepath, "wb") as f:
-        f.write(contents)
+        while chunk := file.file.read(AVATAR_CHUNK_SIZE):
+            total += len(chunk)
+            if total > MAX_AVATAR_SIZE:
+                f.close()
+                os.remove(filepath)
+                raise HTTPException(status_code=400, detail="Image must be under 10MB")
+            f.write(chunk)
+
+    if user.avatar:
+        old_path = os.path.join(AVATARS_DIR, user.avatar)
+        if os.path.exists(old_path):
+            os.remove(old_path)
 
     user.avatar = filename
     db.commit()
+    invalidate_profile_cache(user.id)
     db.refresh(user)
     return _profile_out(user)
@@ -1,14 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, exists
 from typing import List
-from database import get_db
-from models import Server, Channel, User
-from schemas import ChannelCreate, ChannelOut
+from database import get_db, get_async_db
+from models import Server, Channel, User, server_members
+from schemas import ChannelCreate, ChannelOut, rows_response
 from auth import get_current_user
 
 router = APIRouter(prefix="/servers/{server_id}/channels", tags=["channels"])
 
 
+def _membership(server_id: int, user_id: int):
+    """EXISTS probe on the server_members primary key."""
+    return exists().where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
+    )
+
+
 @router.post("/", response_model=ChannelOut, status_code=201)
 def create_channel(
     server_id: int,
@@ -16,29 +25,43 @@ def create_channel(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    server = db.query(Server).filter(Server.id == server_id).first()
+    # Server existence and membership in one query
+    server = db.execute(
+        select(Server.id, _membership(server_id, user.id).label("is_member"))
+        .where(Server.id == server_id)
+    ).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    if user not in server.members:
+    if not server.is_member:
         raise HTTPException(status_code=403, detail="Not a member of this server")
 
     channel = Channel(name=data.name, server_id=server_id)
     db.add(channel)
+    # Flush fills in id and defaults; build the response before commit expires them
+    db.flush()
+    out = ChannelOut(id=channel.id, name=channel.name, server_id=channel.server_id, is_locked=channel.is_locked)
     db.commit()
-    db.refresh(channel)
-    return channel
+    return out
 
 
 @router.get("/", response_model=List[ChannelOut])
-def list_channels(
+async def list_channels(
     server_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    server = db.query(Server).filter(Server.id == server_id).first()
+    # Server existence and membership in one query
+    server = (await db.execute(
+        select(Server.id, _membership(server_id, user.id).label("is_member"))
+        .where(Server.id == server_id)
+    )).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    if user not in server.members:
+    if not server.is_member:
         raise HTTPException(status_code=403, detail="Not a member of this server")
 
-    return server.channels
+    rows = (await db.execute(
+        select(Channel.id, Channel.name, Channel.server_id, Channel.is_locked)
+        .where(Channel.server_id == server_id)
+    )).all()
+    return rows_response([r._asdict() for r in rows])
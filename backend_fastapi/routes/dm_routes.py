@@ -1,16 +1,26 @@
 import os
+import re
+import asyncio
+import hmac
 import uuid
+import hashlib
 import mimetypes
 import httpx
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, func, select, delete, exists, case
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from database import get_db
-from models import Conversation, DirectMessage, User, DMReaction, PinnedMessage, Friend, DmReadState
-from schemas import DMStart, ConversationOut, DMMessageOut, MessageSend, MessageEdit, UserOut, ReactionOut, PinnedMessageOut, FriendDmOut
+from database import get_async_db
+from models import Conversation, DirectMessage, User, DMReaction, PinnedMessage, Friend, DmReadState, DmSearchToken
+from schemas import DMStart, ConversationOut, DMMessageOut, MessageSend, MessageEdit, UserOut, PinnedMessageOut, FriendDmOut, rows_response
 from auth import get_current_user
+from file_uploads import validate_filename, write_upload
+from ws_manager import dm_manager
 
 router = APIRouter(prefix="/dms", tags=["direct-messages"])
 
@@ -18,46 +28,101 @@ RUST_SERVICE_URL = os.getenv("RUST_SERVICE_URL", "http://127.0.0.1:8001")
 UPLOADS_DM_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads", "dms")
 ATTACHMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "attachments")
 
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-ALLOWED_EXTENSIONS = {
-    "png", "jpg", "jpeg", "gif", "webp", "svg",
-    "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx",
-    "txt", "csv", "json", "xml",
-    "zip", "tar", "gz", "rar", "7z",
-    "mp3", "wav", "ogg", "mp4", "webm", "mov",
-}
+SEARCH_RESULT_LIMIT = 50
+SEARCH_SCAN_LIMIT = 200  # most candidate messages one search will decrypt
+
+# Shown in place of deleted DMs; their stored ciphertext is cleared on delete
+DELETED_DM_TEXT = "This message was deleted"
+
+# Stand-in last_read_at for conversations the user has never opened
+_NEVER_READ = datetime(1970, 1, 1)
+
+# Relationships read by _build_dm_message_out, loaded up front for message lists
+_DM_MESSAGE_LOADS = (
+    selectinload(DirectMessage.sender),
+    selectinload(DirectMessage.reactions).selectinload(DMReaction.user),
+)
 
 # Offset DM conversation IDs to avoid key collision with channel IDs in the Rust service
 DM_KEY_OFFSET = 1_000_000
 
+# Key for the DM search blind index (HMAC of each word, never the word itself). Its own
+# secret, not the JWT key: changing it orphans every stored token, so rotate it only
+# together with db_repair.reset_dm_search_index().
+SEARCH_INDEX_KEY = os.getenv("SEARCH_INDEX_KEY", "change-this-search-index-key").encode()
+_WORD_RE = re.compile(r"\w+")
+
+# Shared keep-alive pool to the Rust service; closed in main's lifespan
+rust_client = httpx.AsyncClient(
+    base_url=RUST_SERVICE_URL,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=5.0,
+)
+
 
 async def dm_encrypt(conversation_id: int, plaintext: str) -> str:
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{RUST_SERVICE_URL}/encrypt",
-            json={"channel_id": conversation_id + DM_KEY_OFFSET, "message": plaintext},
-            timeout=5.0,
-        )
+    resp = await rust_client.post(
+        "/encrypt",
+        json={"channel_id": conversation_id + DM_KEY_OFFSET, "message": plaintext},
+    )
     if resp.status_code != 200:
         raise HTTPException(status_code=502, detail="Encryption service error")
     return resp.json()["encrypted"]
 
 
 async def dm_decrypt(conversation_id: int, encrypted: str) -> str:
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{RUST_SERVICE_URL}/decrypt",
-            json={"channel_id": conversation_id + DM_KEY_OFFSET, "encrypted": encrypted},
-            timeout=5.0,
-        )
+    resp = await rust_client.post(
+        "/decrypt",
+        json={"channel_id": conversation_id + DM_KEY_OFFSET, "encrypted": encrypted},
+    )
     if resp.status_code != 200:
         raise HTTPException(status_code=502, detail="Decryption service error")
     return resp.json()["message"]
 
 
-def _get_conversation(db: Session, user: User, conversation_id: int) -> Conversation:
+async def dm_encrypt_many(conversation_id: int, plaintexts: List[str]) -> List[str]:
+    """Encrypt several messages for one conversation in a single service call."""
+    if not plaintexts:
+        return []
+    resp = await rust_client.post(
+        "/encrypt_batch",
+        json={"channel_id": conversation_id + DM_KEY_OFFSET, "messages": plaintexts},
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Encryption service error")
+    return resp.json()["encrypted"]
+
+
+async def dm_decrypt_many(conversation_id: int, ciphertexts: List[str]) -> List[Optional[str]]:
+    """Decrypt several messages in a single service call; None marks an entry that failed."""
+    if not ciphertexts:
+        return []
+    resp = await rust_client.post(
+        "/decrypt_batch",
+        json={"channel_id": conversation_id + DM_KEY_OFFSET, "encrypted": ciphertexts},
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Decryption service error")
+    return resp.json()["messages"]
+
+
+async def _decrypt_dm_rows(conversation_id: int, messages: List[DirectMessage]) -> List[Optional[str]]:
+    """Plaintexts aligned with messages; None for rows that couldn't be decrypted."""
+    ciphertexts = [m.encrypted_content for m in messages]
+    try:
+        return await dm_decrypt_many(conversation_id, ciphertexts)
+    except Exception:
+        # Batch call failed (e.g. a service build without /decrypt_batch):
+        # fall back to per-message calls, issued concurrently over the shared pool
+        results = await asyncio.gather(
+            *(dm_decrypt(conversation_id, c) for c in ciphertexts), return_exceptions=True
+        )
+        return [None if isinstance(r, BaseException) else r for r in results]
+
+
+async def _get_conversation(db: AsyncSession, user: User, conversation_id: int) -> Conversation:
     """Fetch a conversation and verify the user is a participant."""
-    convo = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    convo = await db.get(Conversation, conversation_id)
     if not convo:
         raise HTTPException(status_code=404, detail="Conversation not found")
     if user.id not in (convo.user1_id, convo.user2_id):
@@ -65,130 +130,175 @@ def _get_conversation(db: Session, user: User, conversation_id: int) -> Conversa
     return convo
 
 
+async def _get_dm_message(db: AsyncSession, conversation_id: int, message_id: int) -> Optional[DirectMessage]:
+    """Load one DM with everything _build_dm_message_out reads."""
+    return await db.scalar(
+        select(DirectMessage)
+        .options(*_DM_MESSAGE_LOADS)
+        .where(DirectMessage.id == message_id, DirectMessage.conversation_id == conversation_id)
+    )
+
+
+async def _load_new_dm_message(db: AsyncSession, msg: DirectMessage):
+    """Prepare a just-inserted DM for _build_dm_message_out without querying its (empty) reactions."""
+    await db.refresh(msg, ["sender"])
+    set_committed_value(msg, "reactions", [])
+
+
+async def _find_conversation(db: AsyncSession, a_id: int, b_id: int) -> Optional[Conversation]:
+    # Every pair is stored low id first (db_repair normalizes legacy rows at startup)
+    low, high = sorted((a_id, b_id))
+    return await db.scalar(select(Conversation).where(
+        Conversation.user1_id == low, Conversation.user2_id == high
+    ))
+
+
 def _other_user(convo: Conversation, me: User) -> User:
     return convo.user2 if convo.user1_id == me.id else convo.user1
 
 
-def _avatar_url(user: User) -> str | None:
-    return f"/avatars/{user.avatar}" if user.avatar else None
+@lru_cache(maxsize=1024)
+def _avatar_path(avatar: str) -> str:
+    return f"/avatars/{avatar}"
 
 
-def _validate_file(filename: str, size: int):
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail=f"File type .{ext} not allowed")
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File must be under 10MB")
-    if "/" in filename or "\\" in filename or ".." in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
+def _avatar_url(user: User) -> str | None:
+    # Message lists repeat the same two senders, so the URL string is built once per avatar
+    return _avatar_path(user.avatar) if user.avatar else None
+
+
+def dm_search_hashes(conversation_id: int, text: str) -> set[str]:
+    """Blind-index hashes for each distinct lowercase word, keyed per conversation."""
+    prefix = f"{conversation_id}:".encode()
+    return {
+        hmac.new(SEARCH_INDEX_KEY, prefix + word.encode(), hashlib.sha256).hexdigest()
+        for word in _WORD_RE.findall(text.lower())
+    }
+
+
+async def _reindex_dm_message(db: AsyncSession, msg: DirectMessage, plaintext: Optional[str]):
+    """Replace a message's search tokens; pass None to just drop them."""
+    await db.execute(delete(DmSearchToken).where(DmSearchToken.dm_message_id == msg.id))
+    if plaintext:
+        db.add_all(
+            DmSearchToken(dm_message_id=msg.id, token_hash=h)
+            for h in dm_search_hashes(msg.conversation_id, plaintext)
+        )
 
 
-def _get_dm_reactions(db: Session, dm_message_id: int) -> List[ReactionOut]:
-    reactions = db.query(DMReaction).filter(DMReaction.dm_message_id == dm_message_id).all()
+def _get_dm_reactions(reactions: List[DMReaction]) -> List[dict]:
     emoji_map: dict[str, list[str]] = {}
     for r in reactions:
         emoji_map.setdefault(r.emoji, []).append(r.user.username)
-    return [ReactionOut(emoji=e, count=len(users), users=users) for e, users in emoji_map.items()]
+    return [{"emoji": e, "count": len(users), "users": users} for e, users in emoji_map.items()]
 
 
-def _build_dm_message_out(msg: DirectMessage, plaintext: str, db: Session) -> DMMessageOut:
-    attachment_url = None
-    if msg.attachment:
-        new_path = os.path.join(UPLOADS_DM_DIR, msg.attachment)
-        if os.path.exists(new_path):
-            attachment_url = f"/uploads/dms/{msg.attachment}"
-        else:
-            attachment_url = f"/attachments/{msg.attachment}"
-
-    return DMMessageOut(
-        id=msg.id,
-        content=plaintext,
-        conversation_id=msg.conversation_id,
-        sender_id=msg.sender_id,
-        sender_username=msg.sender.username,
-        sender_display_name=msg.sender.display_name,
-        sender_avatar_url=_avatar_url(msg.sender),
-        attachment_url=attachment_url,
-        attachment_name=msg.attachment_name,
-        attachment_size=msg.attachment_size,
-        attachment_mime=msg.attachment_mime,
-        is_deleted=msg.is_deleted,
-        edited_at=msg.edited_at,
-        reactions=_get_dm_reactions(db, msg.id),
-        created_at=msg.created_at,
-    )
+@lru_cache(maxsize=4096)
+def _attachment_url(attachment: str) -> str:
+    # Files are written before their row exists and never move, so one stat per name is enough
+    if os.path.exists(os.path.join(UPLOADS_DM_DIR, attachment)):
+        return f"/uploads/dms/{attachment}"
+    return f"/attachments/{attachment}"
+
+
+def _dm_message_dict(msg: DirectMessage, plaintext: str) -> dict:
+    """DMMessageOut-shaped dict, for list endpoints that skip pydantic."""
+    attachment_url = _attachment_url(msg.attachment) if msg.attachment else None
+    return {
+        "id": msg.id,
+        "content": plaintext,
+        "conversation_id": msg.conversation_id,
+        "sender_id": msg.sender_id,
+        "sender_username": msg.sender.username,
+        "sender_display_name": msg.sender.display_name,
+        "sender_avatar_url": _avatar_url(msg.sender),
+        "attachment_url": attachment_url,
+        "attachment_name": msg.attachment_name,
+        "attachment_size": msg.attachment_size,
+        "attachment_mime": msg.attachment_mime,
+        "is_deleted": bool(msg.is_deleted),
+        "edited_at": msg.edited_at,
+        "reactions": _get_dm_reactions(msg.reactions),
+        "created_at": msg.created_at,
+    }
+
+
+def _build_dm_message_out(msg: DirectMessage, plaintext: str) -> DMMessageOut:
+    return DMMessageOut(**_dm_message_dict(msg, plaintext))
 
 
 @router.get("/users", response_model=List[FriendDmOut])
-def list_dm_friends(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def list_dm_friends(db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user)):
     """List only friends of the current user with status and unread message counts."""
-    friendships = db.query(Friend).filter(Friend.user_id == user.id).all()
+    friendships = (await db.execute(
+        select(Friend)
+        .options(joinedload(Friend.friend))
+        .where(Friend.user_id == user.id)
+    )).scalars().all()
+
+    # Conversations and their unread counts in one query. The count is a correlated
+    # subquery bounded by last_read_at, so it range-scans only unread rows of
+    # ix_direct_messages_conversation_deleted_created rather than the whole history.
+    last_read = (
+        select(DmReadState.last_read_at)
+        .where(DmReadState.conversation_id == Conversation.id, DmReadState.user_id == user.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    unread = (
+        select(func.count(DirectMessage.id))
+        .where(
+            DirectMessage.conversation_id == Conversation.id,
+            DirectMessage.is_deleted == False,
+            DirectMessage.created_at > func.coalesce(last_read, _NEVER_READ),
+            DirectMessage.sender_id != user.id,
+        )
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    convos = (await db.execute(
+        select(Conversation.id, Conversation.user1_id, Conversation.user2_id, unread)
+        .where(or_(Conversation.user1_id == user.id, Conversation.user2_id == user.id))
+    )).all()
+    convo_by_other = {}
+    unread_by_convo = {}
+    for convo_id, user1_id, user2_id, unread_count in convos:
+        convo_by_other[user2_id if user1_id == user.id else user1_id] = convo_id
+        unread_by_convo[convo_id] = unread_count
 
     result = []
     for f in friendships:
         friend_user = f.friend
-
-        # Find existing conversation between the two users
-        convo = db.query(Conversation).filter(
-            or_(
-                and_(Conversation.user1_id == user.id, Conversation.user2_id == friend_user.id),
-                and_(Conversation.user1_id == friend_user.id, Conversation.user2_id == user.id),
-            )
-        ).first()
-
-        unread_count = 0
-        convo_id = None
-        if convo:
-            convo_id = convo.id
-            # Get the user's read state for this conversation
-            read_state = db.query(DmReadState).filter(
-                DmReadState.user_id == user.id,
-                DmReadState.conversation_id == convo.id,
-            ).first()
-
-            # Count messages from the other user after last_read_at
-            query = db.query(DirectMessage).filter(
-                DirectMessage.conversation_id == convo.id,
-                DirectMessage.sender_id == friend_user.id,
-                DirectMessage.is_deleted == False,
-            )
-            if read_state:
-                query = query.filter(DirectMessage.created_at > read_state.last_read_at)
-            unread_count = query.count()
-
-        result.append(FriendDmOut(
-            user_id=friend_user.id,
-            username=friend_user.username,
-            display_name=friend_user.display_name,
-            avatar_url=_avatar_url(friend_user),
-            status=friend_user.status or "offline",
-            custom_status_text=friend_user.custom_status_text,
-            unread_count=unread_count,
-            conversation_id=convo_id,
-        ))
-    return result
+        convo_id = convo_by_other.get(friend_user.id)
+        unread_count = unread_by_convo.get(convo_id, 0)
+
+        result.append({
+            "user_id": friend_user.id,
+            "username": friend_user.username,
+            "display_name": friend_user.display_name,
+            "avatar_url": _avatar_url(friend_user),
+            "status": friend_user.status or "offline",
+            "custom_status_text": friend_user.custom_status_text,
+            "unread_count": unread_count,
+            "conversation_id": convo_id,
+        })
+    return rows_response(result)
 
 
 @router.post("/", response_model=ConversationOut)
-def start_conversation(
+async def start_conversation(
     data: DMStart,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Start a DM with another user by username, or return existing conversation."""
-    other = db.query(User).filter(User.username == data.username).first()
+    other = await db.scalar(select(User).where(User.username == data.username))
     if not other:
         raise HTTPException(status_code=404, detail="User not found")
     if other.id == user.id:
         raise HTTPException(status_code=400, detail="Cannot DM yourself")
 
-    existing = db.query(Conversation).filter(
-        or_(
-            and_(Conversation.user1_id == user.id, Conversation.user2_id == other.id),
-            and_(Conversation.user1_id == other.id, Conversation.user2_id == user.id),
-        )
-    ).first()
-
+    existing = await _find_conversation(db, user.id, other.id)
     if existing:
         return ConversationOut(
             id=existing.id,
@@ -199,10 +309,16 @@ def start_conversation(
             created_at=existing.created_at,
         )
 
-    convo = Conversation(user1_id=user.id, user2_id=other.id)
+    # New rows always store the lower id first, so the pair is covered by ix_conversations_users
+    low, high = sorted((user.id, other.id))
+    convo = Conversation(user1_id=low, user2_id=high)
     db.add(convo)
-    db.commit()
-    db.refresh(convo)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # The other user opened the same DM concurrently
+        await db.rollback()
+        convo = await _find_conversation(db, user.id, other.id)
 
     return ConversationOut(
         id=convo.id,
@@ -215,41 +331,43 @@ def start_conversation(
 
 
 @router.get("/", response_model=List[ConversationOut])
-def list_conversations(
-    db: Session = Depends(get_db),
+async def list_conversations(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    convos = db.query(Conversation).filter(
-        or_(Conversation.user1_id == user.id, Conversation.user2_id == user.id)
-    ).all()
+    convos = (await db.execute(
+        select(Conversation)
+        .options(selectinload(Conversation.user1), selectinload(Conversation.user2))
+        .where(or_(Conversation.user1_id == user.id, Conversation.user2_id == user.id))
+    )).scalars().all()
 
     result = []
     for c in convos:
         other = _other_user(c, user)
-        result.append(ConversationOut(
-            id=c.id,
-            other_user_id=other.id,
-            other_username=other.username,
-            other_display_name=other.display_name,
-            other_avatar_url=_avatar_url(other),
-            created_at=c.created_at,
-        ))
-    return result
+        result.append({
+            "id": c.id,
+            "other_user_id": other.id,
+            "other_username": other.username,
+            "other_display_name": other.display_name,
+            "other_avatar_url": _avatar_url(other),
+            "created_at": c.created_at,
+        })
+    return rows_response(result)
 
 
 @router.post("/{conversation_id}/read")
-def mark_conversation_read(
+async def mark_conversation_read(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Mark a DM conversation as read (updates the read state timestamp)."""
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    read_state = db.query(DmReadState).filter(
+    read_state = await db.scalar(select(DmReadState).where(
         DmReadState.user_id == user.id,
         DmReadState.conversation_id == conversation_id,
-    ).first()
+    ))
 
     now = datetime.now(timezone.utc)
     if read_state:
@@ -258,47 +376,49 @@ def mark_conversation_read(
         read_state = DmReadState(user_id=user.id, conversation_id=conversation_id, last_read_at=now)
         db.add(read_state)
 
-    db.commit()
+    await db.commit()
     return {"detail": "Conversation marked as read"}
 
 
 @router.get("/{conversation_id}/messages", response_model=List[DMMessageOut])
 async def get_dm_messages(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    messages = (
-        db.query(DirectMessage)
-        .filter(DirectMessage.conversation_id == conversation_id)
+    messages = (await db.execute(
+        select(DirectMessage)
+        .options(*_DM_MESSAGE_LOADS)
+        .where(DirectMessage.conversation_id == conversation_id)
         .order_by(DirectMessage.created_at.asc())
         .limit(100)
-        .all()
-    )
+    )).scalars().all()
+
+    live = [m for m in messages if not m.is_deleted]
+    decrypted = dict(zip((m.id for m in live), await _decrypt_dm_rows(conversation_id, live)))
 
     result = []
     for msg in messages:
         if msg.is_deleted:
-            plaintext = "This message was deleted"
+            plaintext = DELETED_DM_TEXT
         else:
-            try:
-                plaintext = await dm_decrypt(conversation_id, msg.encrypted_content)
-            except Exception:
+            plaintext = decrypted[msg.id]
+            if plaintext is None:
                 plaintext = "[decryption error]"
-        result.append(_build_dm_message_out(msg, plaintext, db))
-    return result
+        result.append(_dm_message_dict(msg, plaintext))
+    return rows_response(result)
 
 
 @router.post("/{conversation_id}/messages", response_model=DMMessageOut, status_code=201)
 async def send_dm_message(
     conversation_id: int,
     data: MessageSend,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
     encrypted = await dm_encrypt(conversation_id, data.content)
 
@@ -308,10 +428,12 @@ async def send_dm_message(
         sender_id=user.id,
     )
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    await db.flush()
+    await _reindex_dm_message(db, msg, data.content)
+    await db.commit()
+    await _load_new_dm_message(db, msg)
 
-    return _build_dm_message_out(msg, data.content, db)
+    return _build_dm_message_out(msg, data.content)
 
 
 @router.post("/{conversation_id}/messages/upload", response_model=DMMessageOut, status_code=201)
@@ -319,11 +441,11 @@ async def send_dm_message_with_file(
     conversation_id: int,
     content: str = Form(""),
     file: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Send a DM message with optional file attachment."""
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
     attachment_filename = None
     original_filename = None
@@ -331,20 +453,14 @@ async def send_dm_message_with_file(
     mime_type = None
 
     if file and file.filename:
-        contents = await file.read()
-        _validate_file(file.filename, len(contents))
-
-        os.makedirs(UPLOADS_DM_DIR, exist_ok=True)
+        ext = validate_filename(file.filename)
 
-        ext = file.filename.rsplit(".", 1)[-1].lower() if "." in file.filename else "bin"
         attachment_filename = f"{uuid.uuid4().hex}.{ext}"
         filepath = os.path.join(UPLOADS_DM_DIR, attachment_filename)
 
-        with open(filepath, "wb") as f:
-            f.write(contents)
-
+        # The whole copy runs in one worker thread so slow disks don't stall the event loop
+        file_size = await asyncio.to_thread(write_upload, file.file, filepath)
         original_filename = file.filename
-        file_size = len(contents)
         mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or "application/octet-stream"
 
     message_text = content.strip() if content else ""
@@ -360,32 +476,16 @@ async def send_dm_message_with_file(
         attachment_mime=mime_type,
     )
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
-
-    out = _build_dm_message_out(msg, message_text, db)
+    await db.flush()
+    await _reindex_dm_message(db, msg, message_text)
+    await db.commit()
+    await _load_new_dm_message(db, msg)
 
-    from ws_manager import dm_manager
-    await dm_manager.broadcast(conversation_id, {
-        "type": "message",
-        "id": msg.id,
-        "content": message_text,
-        "conversation_id": conversation_id,
-        "sender_id": user.id,
-        "sender_username": user.username,
-        "sender_display_name": user.display_name,
-        "sender_avatar_url": _avatar_url(user),
-        "attachment_url": out.attachment_url,
-        "attachment_name": msg.attachment_name,
-        "attachment_size": msg.attachment_size,
-        "attachment_mime": msg.attachment_mime,
-        "is_deleted": False,
-        "edited_at": None,
-        "reactions": [],
-        "created_at": msg.created_at.isoformat(),
-    })
+    # One dict feeds both the broadcast (encoded once for all sockets) and the response
+    data = _dm_message_dict(msg, message_text)
+    await dm_manager.broadcast(conversation_id, {"type": "message", **data})
 
-    return out
+    return DMMessageOut(**data)
 
 
 # ── DM Message Editing ──
@@ -395,14 +495,12 @@ async def edit_dm_message(
     conversation_id: int,
     message_id: int,
     data: MessageEdit,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    msg = db.query(DirectMessage).filter(
-        DirectMessage.id == message_id, DirectMessage.conversation_id == conversation_id
-    ).first()
+    msg = await _get_dm_message(db, conversation_id, message_id)
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
     if msg.sender_id != user.id:
@@ -417,10 +515,9 @@ async def edit_dm_message(
     encrypted = await dm_encrypt(conversation_id, data.content)
     msg.encrypted_content = encrypted
     msg.edited_at = now
-    db.commit()
-    db.refresh(msg)
+    await _reindex_dm_message(db, msg, data.content)
+    await db.commit()
 
-    from ws_manager import dm_manager
     await dm_manager.broadcast(conversation_id, {
         "type": "message_edited",
         "message_id": msg.id,
@@ -428,7 +525,7 @@ async def edit_dm_message(
         "edited_at": msg.edited_at.isoformat(),
     })
 
-    return _build_dm_message_out(msg, data.content, db)
+    return _build_dm_message_out(msg, data.content)
 
 
 # ── DM Message Deletion ──
@@ -437,14 +534,12 @@ async def edit_dm_message(
 async def delete_dm_message(
     conversation_id: int,
     message_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    msg = db.query(DirectMessage).filter(
-        DirectMessage.id == message_id, DirectMessage.conversation_id == conversation_id
-    ).first()
+    msg = await _get_dm_message(db, conversation_id, message_id)
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
     # In DMs, only sender can delete
@@ -453,20 +548,18 @@ async def delete_dm_message(
     if msg.is_deleted:
         raise HTTPException(status_code=400, detail="Already deleted")
 
-    deleted_text = "This message was deleted"
-    encrypted = await dm_encrypt(conversation_id, deleted_text)
-    msg.encrypted_content = encrypted
+    # Read paths show DELETED_DM_TEXT for deleted rows, so there's nothing to encrypt
+    msg.encrypted_content = ""
     msg.is_deleted = True
-    db.commit()
-    db.refresh(msg)
+    await _reindex_dm_message(db, msg, None)
+    await db.commit()
 
-    from ws_manager import dm_manager
     await dm_manager.broadcast(conversation_id, {
         "type": "message_deleted",
         "message_id": msg.id,
     })
 
-    return _build_dm_message_out(msg, deleted_text, db)
+    return _build_dm_message_out(msg, DELETED_DM_TEXT)
 
 
 # ── DM Emoji Reactions ──
@@ -476,31 +569,39 @@ async def toggle_dm_reaction(
     conversation_id: int,
     message_id: int,
     emoji: str = Query(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    msg = db.query(DirectMessage).filter(
+    found = await db.scalar(select(exists().where(
         DirectMessage.id == message_id, DirectMessage.conversation_id == conversation_id
-    ).first()
-    if not msg:
+    )))
+    if not found:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    existing = db.query(DMReaction).filter(
-        DMReaction.user_id == user.id, DMReaction.dm_message_id == message_id, DMReaction.emoji == emoji
-    ).first()
+    # This user's reaction (if any) and the emoji's total, in one query
+    existing, count = (await db.execute(
+        select(
+            func.max(case((DMReaction.user_id == user.id, DMReaction.id))),
+            func.count(DMReaction.id),
+        ).where(DMReaction.dm_message_id == message_id, DMReaction.emoji == emoji)
+    )).one()
 
     if existing:
-        db.delete(existing)
+        await db.execute(delete(DMReaction).where(DMReaction.id == existing))
+        count -= 1
     else:
         db.add(DMReaction(user_id=user.id, dm_message_id=message_id, emoji=emoji))
+        count += 1
 
-    db.commit()
-
-    count = db.query(DMReaction).filter(DMReaction.dm_message_id == message_id, DMReaction.emoji == emoji).count()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent toggle added the same reaction first
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Reaction already added")
 
-    from ws_manager import dm_manager
     await dm_manager.broadcast(conversation_id, {
         "type": "reaction_update",
         "message_id": message_id,
@@ -519,30 +620,56 @@ async def toggle_dm_reaction(
 async def search_dm_messages(
     conversation_id: int,
     q: str = Query(..., min_length=1),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
-
-    messages = (
-        db.query(DirectMessage)
-        .filter(DirectMessage.conversation_id == conversation_id, DirectMessage.is_deleted == False)
-        .order_by(DirectMessage.created_at.desc())
-        .limit(200)
-        .all()
+    await _get_conversation(db, user, conversation_id)
+
+    stmt = (
+        select(DirectMessage)
+        .options(*_DM_MESSAGE_LOADS)
+        .where(DirectMessage.conversation_id == conversation_id, DirectMessage.is_deleted == False)
     )
+    hashes = dm_search_hashes(conversation_id, q)
+    if hashes:
+        # Only decrypt rows holding every query word, plus rows that predate the index
+        indexed_matches = (
+            select(DmSearchToken.dm_message_id)
+            .where(DmSearchToken.token_hash.in_(hashes))
+            .group_by(DmSearchToken.dm_message_id)
+            .having(func.count(DmSearchToken.id) == len(hashes))
+        )
+        unindexed = ~exists().where(DmSearchToken.dm_message_id == DirectMessage.id)
+        stmt = stmt.where(or_(DirectMessage.id.in_(indexed_matches), unindexed))
 
+    stmt = stmt.order_by(DirectMessage.created_at.desc())
+
+    # Indexed and legacy rows match by the same rule the index encodes: every query
+    # word appears as a whole word. A query with no words falls back to a substring match.
     query_lower = q.lower()
+    query_words = set(_WORD_RE.findall(query_lower))
+
+    def matches(plaintext: str) -> bool:
+        text = plaintext.lower()
+        if query_words:
+            return query_words <= set(_WORD_RE.findall(text))
+        return query_lower in text
+
+    # Walk candidates newest-first a page at a time and stop once the page of results is full
     result = []
-    for msg in messages:
-        try:
-            plaintext = await dm_decrypt(conversation_id, msg.encrypted_content)
-        except Exception:
-            continue
-        if query_lower in plaintext.lower():
-            result.append(_build_dm_message_out(msg, plaintext, db))
+    for offset in range(0, SEARCH_SCAN_LIMIT, SEARCH_RESULT_LIMIT):
+        messages = (await db.execute(
+            stmt.offset(offset).limit(SEARCH_RESULT_LIMIT)
+        )).scalars().all()
+        for msg, plaintext in zip(messages, await _decrypt_dm_rows(conversation_id, messages)):
+            if plaintext is None:
+                continue
+            if matches(plaintext):
+                result.append(_dm_message_dict(msg, plaintext))
+        if len(result) >= SEARCH_RESULT_LIMIT or len(messages) < SEARCH_RESULT_LIMIT:
+            break
 
-    return result[:50]
+    return rows_response(result[:SEARCH_RESULT_LIMIT])
 
 
 # ── DM Pinned Messages ──
@@ -551,38 +678,44 @@ async def search_dm_messages(
 async def pin_dm_message(
     conversation_id: int,
     message_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    msg = db.query(DirectMessage).filter(
-        DirectMessage.id == message_id, DirectMessage.conversation_id == conversation_id
-    ).first()
+    msg = await _get_dm_message(db, conversation_id, message_id)
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    pin_count = db.query(PinnedMessage).filter(PinnedMessage.conversation_id == conversation_id).count()
+    # Pin count and "already pinned" in one pass over the conversation's pins
+    pin_count, already_pinned = (await db.execute(
+        select(
+            func.count(PinnedMessage.id),
+            func.count(case((PinnedMessage.dm_message_id == message_id, 1))),
+        ).where(PinnedMessage.conversation_id == conversation_id)
+    )).one()
     if pin_count >= 10:
         raise HTTPException(status_code=400, detail="Maximum 10 pinned messages per conversation")
-
-    existing = db.query(PinnedMessage).filter(
-        PinnedMessage.dm_message_id == message_id, PinnedMessage.conversation_id == conversation_id
-    ).first()
-    if existing:
+    if already_pinned:
         raise HTTPException(status_code=400, detail="Message already pinned")
 
     pin = PinnedMessage(dm_message_id=message_id, conversation_id=conversation_id, pinned_by=user.id)
     db.add(pin)
-    db.commit()
-    db.refresh(pin)
-
     try:
-        content = await dm_decrypt(conversation_id, msg.encrypted_content)
-    except Exception:
-        content = "[encrypted]"
+        await db.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent pin of the same message
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Message already pinned")
+
+    if msg.is_deleted:
+        content = DELETED_DM_TEXT
+    else:
+        try:
+            content = await dm_decrypt(conversation_id, msg.encrypted_content)
+        except Exception:
+            content = "[encrypted]"
 
-    from ws_manager import dm_manager
     await dm_manager.broadcast(conversation_id, {
         "type": "message_pinned",
         "message_id": message_id,
@@ -601,21 +734,20 @@ async def pin_dm_message(
 async def unpin_dm_message(
     conversation_id: int,
     message_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    pin = db.query(PinnedMessage).filter(
+    pin = await db.scalar(select(PinnedMessage).where(
         PinnedMessage.dm_message_id == message_id, PinnedMessage.conversation_id == conversation_id
-    ).first()
+    ))
     if not pin:
         raise HTTPException(status_code=404, detail="Message not pinned")
 
-    db.delete(pin)
-    db.commit()
+    await db.delete(pin)
+    await db.commit()
 
-    from ws_manager import dm_manager
     await dm_manager.broadcast(conversation_id, {
         "type": "message_unpinned",
         "message_id": message_id,
@@ -627,32 +759,38 @@ async def unpin_dm_message(
 @router.get("/{conversation_id}/messages/pinned", response_model=List[PinnedMessageOut])
 async def get_pinned_dm_messages(
     conversation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    _get_conversation(db, user, conversation_id)
+    await _get_conversation(db, user, conversation_id)
 
-    pins = (
-        db.query(PinnedMessage)
-        .filter(PinnedMessage.conversation_id == conversation_id)
+    pins = (await db.execute(
+        select(PinnedMessage)
+        .options(
+            selectinload(PinnedMessage.dm_message).selectinload(DirectMessage.sender),
+            selectinload(PinnedMessage.pinner),
+        )
+        .where(PinnedMessage.conversation_id == conversation_id)
         .order_by(PinnedMessage.pinned_at.desc())
-        .all()
-    )
+    )).scalars().all()
+
+    pins = [pin for pin in pins if pin.dm_message]
+    live = [pin.dm_message for pin in pins if not pin.dm_message.is_deleted]
+    decrypted = dict(zip((m.id for m in live), await _decrypt_dm_rows(conversation_id, live)))
 
     result = []
     for pin in pins:
         msg = pin.dm_message
-        if not msg:
-            continue
-        try:
-            content = await dm_decrypt(conversation_id, msg.encrypted_content)
-        except Exception:
-            content = "[encrypted]"
-        result.append(PinnedMessageOut(
-            id=pin.id, dm_message_id=msg.id, pinned_by=pin.pinned_by,
-            pinned_by_username=pin.pinner.username, pinned_at=pin.pinned_at,
-            content=content, author_username=msg.sender.username,
-            author_display_name=msg.sender.display_name,
-        ))
-
-    return result
+        if msg.is_deleted:
+            content = DELETED_DM_TEXT
+        else:
+            content = decrypted[msg.id]
+            if content is None:
+                content = "[encrypted]"
+        result.append({
+            "id": pin.id, "message_id": None, "dm_message_id": msg.id, "pinned_by": pin.pinned_by,
+            "pinned_by_username": pin.pinner.username, "pinned_at": pin.pinned_at,
+            "content": content, "author_username": msg.sender.username,
+            "author_display_name": msg.sender.display_name,
+        })
+    return rows_response(result)
@@ -1,110 +1,143 @@
-import asyncio
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, insert, update, select, exists, delete, literal
+from sqlalchemy.exc import IntegrityError
 from typing import List
-from database import get_db
+from database import get_async_db, strict_loads
 from models import User, FriendRequest, Friend, BlockedUser, Notification
-from schemas import FriendRequestCreate, FriendRequestOut, FriendOut, BlockedUserOut
+from schemas import FriendRequestCreate, FriendRequestOut, FriendOut, BlockedUserOut, rows_response
 from auth import get_current_user
+from ws_manager import notify_users
 
 router = APIRouter(prefix="/friends", tags=["friends"])
 
+# Users read by _build_request_out, joined into the request query
+_REQUEST_LOADS = strict_loads(joinedload(FriendRequest.sender), joinedload(FriendRequest.receiver))
+
 
 def _avatar_url(user: User) -> str | None:
     return f"/avatars/{user.avatar}" if user.avatar else None
 
 
-def _notify_user_ws(user_id: int, payload: dict):
-    """Send a WebSocket message to all connections of a specific user."""
-    from ws_manager import connected_users
-    for ws in list(connected_users.get(user_id, set())):
-        try:
-            asyncio.get_event_loop().create_task(ws.send_json(payload))
-        except Exception:
-            pass
+def _request_dict(req: FriendRequest) -> dict:
+    return {
+        "id": req.id,
+        "sender_id": req.sender_id,
+        "sender_username": req.sender.username,
+        "sender_display_name": req.sender.display_name,
+        "sender_avatar_url": _avatar_url(req.sender),
+        "receiver_id": req.receiver_id,
+        "receiver_username": req.receiver.username,
+        "receiver_display_name": req.receiver.display_name,
+        "receiver_avatar_url": _avatar_url(req.receiver),
+        "status": req.status,
+        "created_at": req.created_at,
+    }
 
 
 def _build_request_out(req: FriendRequest) -> FriendRequestOut:
-    return FriendRequestOut(
-        id=req.id,
-        sender_id=req.sender_id,
-        sender_username=req.sender.username,
-        sender_display_name=req.sender.display_name,
-        sender_avatar_url=_avatar_url(req.sender),
-        receiver_id=req.receiver_id,
-        receiver_username=req.receiver.username,
-        receiver_display_name=req.receiver.display_name,
-        receiver_avatar_url=_avatar_url(req.receiver),
-        status=req.status,
-        created_at=req.created_at,
+    return FriendRequestOut(**_request_dict(req))
+
+
+# Friend notification frames use short keys to keep broadcasts small:
+#   type "fr"; they share sockets with chat frames, and the chat pages treat a
+#        frame without a type as a message
+#   t    event: FR_RECEIVED | FR_ACCEPTED | FR_DENIED
+#   rid  friend request id
+#   u, n the other user's id and username (sender, new friend, or denier)
+#   d, a display name and avatar url, omitted when unset or for FR_DENIED
+#   s    the new friend's status (FR_ACCEPTED only)
+FR_RECEIVED = 1
+FR_ACCEPTED = 2
+FR_DENIED = 3
+
+
+def _pack_friend_event(
+    event: int, request_id: int, other: User, profile: bool = True, with_status: bool = False
+) -> dict:
+    frame = {"type": "fr", "t": event, "rid": request_id, "u": other.id, "n": other.username}
+    if profile:
+        if other.display_name:
+            frame["d"] = other.display_name
+        if other.avatar:
+            frame["a"] = _avatar_url(other)
+    if with_status:
+        frame["s"] = other.status or "offline"
+    return frame
+
+
+def _request_blockers(sender_id: int, receiver_id: int):
+    """EXISTS guards for a new request: (blocked either way, already friends, pending either way)."""
+    return (
+        exists().where(or_(
+            and_(BlockedUser.user_id == sender_id, BlockedUser.blocked_user_id == receiver_id),
+            and_(BlockedUser.user_id == receiver_id, BlockedUser.blocked_user_id == sender_id),
+        )),
+        exists().where(Friend.user_id == sender_id, Friend.friend_id == receiver_id),
+        exists().where(
+            FriendRequest.status == "pending",
+            or_(
+                and_(FriendRequest.sender_id == sender_id, FriendRequest.receiver_id == receiver_id),
+                and_(FriendRequest.sender_id == receiver_id, FriendRequest.receiver_id == sender_id),
+            ),
+        ),
     )
 
 
 # ── Send friend request ──
 
 @router.post("/request", response_model=FriendRequestOut, status_code=201)
-def send_friend_request(
+async def send_friend_request(
     data: FriendRequestCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    other = db.query(User).filter(User.username == data.username).first()
+    other = await db.scalar(select(User).where(User.username == data.username))
     if not other:
         raise HTTPException(status_code=404, detail="User not found")
     if other.id == user.id:
         raise HTTPException(status_code=400, detail="Cannot send request to yourself")
 
-    # Check if blocked
-    blocked = db.query(BlockedUser).filter(
-        or_(
-            and_(BlockedUser.user_id == user.id, BlockedUser.blocked_user_id == other.id),
-            and_(BlockedUser.user_id == other.id, BlockedUser.blocked_user_id == user.id),
-        )
-    ).first()
-    if blocked:
-        raise HTTPException(status_code=400, detail="Cannot send request to this user")
-
-    # Check if already friends
-    existing_friend = db.query(Friend).filter(
-        Friend.user_id == user.id, Friend.friend_id == other.id
-    ).first()
-    if existing_friend:
-        raise HTTPException(status_code=400, detail="Already friends")
-
-    # Check for existing pending request in either direction
-    existing = db.query(FriendRequest).filter(
-        FriendRequest.status == "pending",
-        or_(
-            and_(FriendRequest.sender_id == user.id, FriendRequest.receiver_id == other.id),
-            and_(FriendRequest.sender_id == other.id, FriendRequest.receiver_id == user.id),
-        )
-    ).first()
-    if existing:
+    # Insert only when nothing stands in the way; the guards run inside the INSERT,
+    # so the happy path never reads them back separately
+    blockers = _request_blockers(user.id, other.id)
+    try:
+        inserted = (await db.execute(
+            insert(FriendRequest)
+            .from_select(
+                ["sender_id", "receiver_id"],
+                select(literal(user.id), literal(other.id)).where(*(~g for g in blockers)),
+            )
+            .returning(FriendRequest.id, FriendRequest.created_at)
+        )).first()
+    except IntegrityError:
+        # A concurrent request for the same pair won; SQLite checks
+        # uq_friend_requests_pending_pair as the INSERT runs
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Friend request already pending")
+    if inserted is None:
+        blocked, friends, _ = (await db.execute(select(*blockers))).one()
+        if blocked:
+            raise HTTPException(status_code=400, detail="Cannot send request to this user")
+        if friends:
+            raise HTTPException(status_code=400, detail="Already friends")
         raise HTTPException(status_code=400, detail="Friend request already pending")
 
-    req = FriendRequest(sender_id=user.id, receiver_id=other.id)
-    db.add(req)
-
-    # Create notification
-    notif = Notification(
+    db.add(Notification(
         user_id=other.id,
         type="friend_request",
-        reference_id=req.id,
+        reference_id=inserted.id,
         content=f"{user.username} sent you a friend request",
+    ))
+    await db.commit()
+    req = FriendRequest(
+        id=inserted.id, sender_id=user.id, receiver_id=other.id, status="pending",
+        created_at=inserted.created_at, sender=user, receiver=other,
     )
-    db.add(notif)
-    db.commit()
-    db.refresh(req)
-
-    _notify_user_ws(other.id, {
-        "type": "friend_request_received",
-        "request_id": req.id,
-        "sender_id": user.id,
-        "sender_username": user.username,
-        "sender_display_name": user.display_name,
-        "sender_avatar_url": _avatar_url(user),
-    })
+
+    # Queued on each socket's writer, so a slow socket never delays the response
+    notify_users([(other.id, _pack_friend_event(FR_RECEIVED, req.id, user))])
 
     return _build_request_out(req)
 
@@ -112,74 +145,87 @@ def send_friend_request(
 # ── List pending requests ──
 
 @router.get("/requests/incoming", response_model=List[FriendRequestOut])
-def get_incoming_requests(
-    db: Session = Depends(get_db),
+async def get_incoming_requests(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    reqs = db.query(FriendRequest).filter(
-        FriendRequest.receiver_id == user.id, FriendRequest.status == "pending"
-    ).all()
-    return [_build_request_out(r) for r in reqs]
+    reqs = (await db.execute(
+        select(FriendRequest).options(*_REQUEST_LOADS).where(
+            FriendRequest.receiver_id == user.id, FriendRequest.status == "pending"
+        )
+    )).scalars().all()
+    return rows_response([_request_dict(r) for r in reqs])
 
 
 @router.get("/requests/outgoing", response_model=List[FriendRequestOut])
-def get_outgoing_requests(
-    db: Session = Depends(get_db),
+async def get_outgoing_requests(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    reqs = db.query(FriendRequest).filter(
-        FriendRequest.sender_id == user.id, FriendRequest.status == "pending"
-    ).all()
-    return [_build_request_out(r) for r in reqs]
+    reqs = (await db.execute(
+        select(FriendRequest).options(*_REQUEST_LOADS).where(
+            FriendRequest.sender_id == user.id, FriendRequest.status == "pending"
+        )
+    )).scalars().all()
+    return rows_response([_request_dict(r) for r in reqs])
+
+
+async def _answer_request(db: AsyncSession, request_id: int, user: User, status: str) -> FriendRequest:
+    """Move a pending request addressed to user to status, atomically.
+
+    The status check lives in the UPDATE's WHERE, so a double-submitted accept
+    can't pass it twice. The request's own row is only read on the failure path.
+    """
+    row = (await db.execute(
+        update(FriendRequest)
+        .where(
+            FriendRequest.id == request_id,
+            FriendRequest.receiver_id == user.id,
+            FriendRequest.status == "pending",
+        )
+        .values(status=status)
+        .returning(FriendRequest.sender_id, FriendRequest.created_at)
+    )).first()
+    if row is None:
+        req = await db.get(FriendRequest, request_id)
+        if not req:
+            raise HTTPException(status_code=404, detail="Request not found")
+        if req.receiver_id != user.id:
+            raise HTTPException(status_code=403, detail="Not your request")
+        raise HTTPException(status_code=400, detail="Request already handled")
+
+    sender = await db.get(User, row.sender_id)
+    return FriendRequest(
+        id=request_id, sender_id=row.sender_id, receiver_id=user.id, status=status,
+        created_at=row.created_at, sender=sender, receiver=user,
+    )
 
 
 # ── Accept friend request ──
 
 @router.post("/request/{request_id}/accept", response_model=FriendRequestOut)
-def accept_friend_request(
+async def accept_friend_request(
     request_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    req = db.query(FriendRequest).filter(FriendRequest.id == request_id).first()
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found")
-    if req.receiver_id != user.id:
-        raise HTTPException(status_code=403, detail="Not your request")
-    if req.status != "pending":
-        raise HTTPException(status_code=400, detail="Request already handled")
-
-    req.status = "accepted"
+    req = await _answer_request(db, request_id, user, "accepted")
 
-    # Create bidirectional friendship
-    db.add(Friend(user_id=req.sender_id, friend_id=req.receiver_id))
-    db.add(Friend(user_id=req.receiver_id, friend_id=req.sender_id))
+    # Create bidirectional friendship in one multi-row INSERT
+    await db.execute(insert(Friend), [
+        {"user_id": req.sender_id, "friend_id": req.receiver_id},
+        {"user_id": req.receiver_id, "friend_id": req.sender_id},
+    ])
 
-    db.commit()
-    db.refresh(req)
+    await db.commit()
 
-    # Notify the sender that their request was accepted
-    _notify_user_ws(req.sender_id, {
-        "type": "friend_request_accepted",
-        "request_id": req.id,
-        "friend_id": user.id,
-        "friend_username": user.username,
-        "friend_display_name": user.display_name,
-        "friend_avatar_url": _avatar_url(user),
-        "friend_status": user.status or "offline",
-    })
-
-    # Notify the acceptor's own other connections
+    # Notify the sender that their request was accepted, and the acceptor's
+    # own other connections
     sender = req.sender
-    _notify_user_ws(user.id, {
-        "type": "friend_request_accepted",
-        "request_id": req.id,
-        "friend_id": sender.id,
-        "friend_username": sender.username,
-        "friend_display_name": sender.display_name,
-        "friend_avatar_url": _avatar_url(sender),
-        "friend_status": sender.status or "offline",
-    })
+    notify_users([
+        (req.sender_id, _pack_friend_event(FR_ACCEPTED, req.id, user, with_status=True)),
+        (user.id, _pack_friend_event(FR_ACCEPTED, req.id, sender, with_status=True)),
+    ])
 
     return _build_request_out(req)
 
@@ -187,30 +233,16 @@ def accept_friend_request(
 # ── Deny friend request ──
 
 @router.post("/request/{request_id}/deny", response_model=FriendRequestOut)
-def deny_friend_request(
+async def deny_friend_request(
     request_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    req = db.query(FriendRequest).filter(FriendRequest.id == request_id).first()
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found")
-    if req.receiver_id != user.id:
-        raise HTTPException(status_code=403, detail="Not your request")
-    if req.status != "pending":
-        raise HTTPException(status_code=400, detail="Request already handled")
-
-    req.status = "denied"
-    db.commit()
-    db.refresh(req)
+    req = await _answer_request(db, request_id, user, "denied")
+    await db.commit()
 
     # Notify the sender that their request was denied
-    _notify_user_ws(req.sender_id, {
-        "type": "friend_request_denied",
-        "request_id": req.id,
-        "denier_id": user.id,
-        "denier_username": user.username,
-    })
+    notify_users([(req.sender_id, _pack_friend_event(FR_DENIED, req.id, user, profile=False))])
 
     return _build_request_out(req)
 
@@ -218,12 +250,12 @@ def deny_friend_request(
 # ── Cancel outgoing request ──
 
 @router.delete("/request/{request_id}")
-def cancel_friend_request(
+async def cancel_friend_request(
     request_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    req = db.query(FriendRequest).filter(FriendRequest.id == request_id).first()
+    req = await db.get(FriendRequest, request_id)
     if not req:
         raise HTTPException(status_code=404, detail="Request not found")
     if req.sender_id != user.id:
@@ -231,132 +263,133 @@ def cancel_friend_request(
     if req.status != "pending":
         raise HTTPException(status_code=400, detail="Request already handled")
 
-    db.delete(req)
-    db.commit()
+    await db.delete(req)
+    await db.commit()
     return {"detail": "Request cancelled"}
 
 
 # ── List friends ──
 
 @router.get("/", response_model=List[FriendOut])
-def list_friends(
-    db: Session = Depends(get_db),
+async def list_friends(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    friendships = db.query(Friend).filter(Friend.user_id == user.id).all()
-    result = []
-    for f in friendships:
-        friend_user = f.friend
-        result.append(FriendOut(
-            id=f.id,
-            user_id=friend_user.id,
-            username=friend_user.username,
-            display_name=friend_user.display_name,
-            avatar_url=_avatar_url(friend_user),
-            status=friend_user.status or "offline",
-            custom_status_text=friend_user.custom_status_text,
-        ))
-    return result
+    # Plain column rows from one join; no ORM instances are built for a read-only list
+    rows = (await db.execute(
+        select(
+            Friend.id, User.id.label("user_id"), User.username, User.display_name,
+            User.avatar, User.status, User.custom_status_text,
+        )
+        .join(User, User.id == Friend.friend_id)
+        .where(Friend.user_id == user.id)
+    )).all()
+    return rows_response([
+        {
+            "id": r.id,
+            "user_id": r.user_id,
+            "username": r.username,
+            "display_name": r.display_name,
+            "avatar_url": f"/avatars/{r.avatar}" if r.avatar else None,
+            "status": r.status or "offline",
+            "custom_status_text": r.custom_status_text,
+        }
+        for r in rows
+    ])
 
 
 # ── Remove friend ──
 
 @router.delete("/{friend_user_id}")
-def remove_friend(
+async def remove_friend(
     friend_user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    # Remove both directions
-    f1 = db.query(Friend).filter(Friend.user_id == user.id, Friend.friend_id == friend_user_id).first()
-    f2 = db.query(Friend).filter(Friend.user_id == friend_user_id, Friend.friend_id == user.id).first()
-    if not f1:
+    # Remove both directions in one statement; no rows means there was no friendship
+    result = await db.execute(delete(Friend).where(or_(
+        and_(Friend.user_id == user.id, Friend.friend_id == friend_user_id),
+        and_(Friend.user_id == friend_user_id, Friend.friend_id == user.id),
+    )))
+    if not result.rowcount:
         raise HTTPException(status_code=404, detail="Not friends")
-    if f1:
-        db.delete(f1)
-    if f2:
-        db.delete(f2)
-    db.commit()
+    await db.commit()
     return {"detail": "Friend removed"}
 
 
 # ── Block user ──
 
 @router.post("/block/{target_user_id}")
-def block_user(
+async def block_user(
     target_user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     if target_user_id == user.id:
         raise HTTPException(status_code=400, detail="Cannot block yourself")
 
-    target = db.query(User).filter(User.id == target_user_id).first()
-    if not target:
+    row = (await db.execute(
+        select(
+            User.id,
+            exists().where(
+                BlockedUser.user_id == user.id, BlockedUser.blocked_user_id == User.id
+            ).label("blocked"),
+        ).where(User.id == target_user_id)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-
-    existing = db.query(BlockedUser).filter(
-        BlockedUser.user_id == user.id, BlockedUser.blocked_user_id == target_user_id
-    ).first()
-    if existing:
+    if row.blocked:
         raise HTTPException(status_code=400, detail="Already blocked")
 
     db.add(BlockedUser(user_id=user.id, blocked_user_id=target_user_id))
 
     # Also remove friendship if exists
-    f1 = db.query(Friend).filter(Friend.user_id == user.id, Friend.friend_id == target_user_id).first()
-    f2 = db.query(Friend).filter(Friend.user_id == target_user_id, Friend.friend_id == user.id).first()
-    if f1:
-        db.delete(f1)
-    if f2:
-        db.delete(f2)
+    await db.execute(delete(Friend).where(or_(
+        and_(Friend.user_id == user.id, Friend.friend_id == target_user_id),
+        and_(Friend.user_id == target_user_id, Friend.friend_id == user.id),
+    )))
 
     # Cancel any pending requests
-    pending = db.query(FriendRequest).filter(
+    await db.execute(delete(FriendRequest).where(
         FriendRequest.status == "pending",
         or_(
             and_(FriendRequest.sender_id == user.id, FriendRequest.receiver_id == target_user_id),
             and_(FriendRequest.sender_id == target_user_id, FriendRequest.receiver_id == user.id),
-        )
-    ).all()
-    for p in pending:
-        db.delete(p)
+        ),
+    ))
 
-    db.commit()
+    await db.commit()
     return {"detail": "User blocked"}
 
 
 # ── Unblock user ──
 
 @router.delete("/block/{target_user_id}")
-def unblock_user(
+async def unblock_user(
     target_user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    block = db.query(BlockedUser).filter(
+    block = await db.scalar(select(BlockedUser).where(
         BlockedUser.user_id == user.id, BlockedUser.blocked_user_id == target_user_id
-    ).first()
+    ))
     if not block:
         raise HTTPException(status_code=404, detail="User not blocked")
-    db.delete(block)
-    db.commit()
+    await db.delete(block)
+    await db.commit()
     return {"detail": "User unblocked"}
 
 
 # ── List blocked ──
 
 @router.get("/blocked", response_model=List[BlockedUserOut])
-def list_blocked(
-    db: Session = Depends(get_db),
+async def list_blocked(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    blocks = db.query(BlockedUser).filter(BlockedUser.user_id == user.id).all()
-    return [
-        BlockedUserOut(
-            id=b.id,
-            blocked_user_id=b.blocked_user_id,
-            username=b.blocked_user.username,
-        )
-        for b in blocks
-    ]
+    rows = (await db.execute(
+        select(BlockedUser.id, BlockedUser.blocked_user_id, User.username)
+        .join(User, User.id == BlockedUser.blocked_user_id)
+        .where(BlockedUser.user_id == user.id)
+    )).all()
+    return rows_response([r._asdict() for r in rows])
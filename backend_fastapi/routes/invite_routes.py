@@ -1,48 +1,94 @@
-import secrets
+import base64
+import os
+import threading
 from datetime import datetime, timezone, timedelta
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, exists, insert
 from typing import List
-from database import get_db
+from database import get_async_db, strict_loads
 from models import Server, ServerInvite, User, Notification, server_members, BannedUser
-from schemas import InviteCreate, InviteOut, InviteJoin, ServerOut
+from schemas import InviteCreate, InviteOut, InviteJoin, ServerOut, rows_response
 from auth import get_current_user
 
 router = APIRouter(prefix="/invites", tags=["invites"])
 
+INVITE_CODE_BYTES = 8
+
+
+class _RandomPool:
+    """Hands out slices of one os.urandom read, refilling it when it runs low."""
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self.buf = b""
+        self.lock = threading.Lock()
+
+    def take(self, n: int) -> bytes:
+        with self.lock:
+            if len(self.buf) < n:
+                self.buf = os.urandom(self.size)
+            out, self.buf = self.buf[:n], self.buf[n:]
+        return out
+
+
+_random_pool = _RandomPool()
+
+
+def _new_invite_code() -> str:
+    """Same shape as secrets.token_urlsafe(8), without a syscall per invite."""
+    return base64.urlsafe_b64encode(_random_pool.take(INVITE_CODE_BYTES)).rstrip(b"=").decode()
+
+
+def _invite_dict(inv: ServerInvite) -> dict:
+    return {
+        "id": inv.id,
+        "server_id": inv.server_id,
+        "server_name": inv.server.name,
+        "code": inv.code,
+        "expires_at": inv.expires_at,
+        "max_uses": inv.max_uses,
+        "uses": inv.uses,
+        "created_by": inv.created_by,
+        "created_at": inv.created_at,
+    }
+
 
 def _build_invite_out(inv: ServerInvite) -> InviteOut:
-    return InviteOut(
-        id=inv.id,
-        server_id=inv.server_id,
-        server_name=inv.server.name,
-        code=inv.code,
-        expires_at=inv.expires_at,
-        max_uses=inv.max_uses,
-        uses=inv.uses,
-        created_by=inv.created_by,
-        created_at=inv.created_at,
+    return InviteOut(**_invite_dict(inv))
+
+
+def _membership(server_id: int, user_id: int):
+    """EXISTS probe on the server_members primary key."""
+    return exists().where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
     )
 
 
+async def _is_member(db: AsyncSession, server_id: int, user_id: int) -> bool:
+    return await db.scalar(select(_membership(server_id, user_id)))
+
+
 @router.post("/servers/{server_id}", response_model=InviteOut, status_code=201)
-def create_invite(
+async def create_invite(
     server_id: int,
     data: InviteCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    server = db.query(Server).filter(Server.id == server_id).first()
+    server = await db.get(Server, server_id)
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    if user not in server.members:
+    if not await _is_member(db, server_id, user.id):
         raise HTTPException(status_code=403, detail="Not a member")
 
     expires_at = None
     if data.expires_hours:
         expires_at = datetime.now(timezone.utc) + timedelta(hours=data.expires_hours)
 
-    code = secrets.token_urlsafe(8)
+    code = _new_invite_code()
     invite = ServerInvite(
         server_id=server_id,
         code=code,
@@ -51,34 +97,45 @@ def create_invite(
         created_by=user.id,
     )
     db.add(invite)
-    db.commit()
-    db.refresh(invite)
+    await db.commit()
+    set_committed_value(invite, "server", server)
     return _build_invite_out(invite)
 
 
 @router.get("/servers/{server_id}", response_model=List[InviteOut])
-def list_invites(
+async def list_invites(
     server_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    server = db.query(Server).filter(Server.id == server_id).first()
+    # The server name every row repeats and both guards, in one query
+    server = (await db.execute(
+        select(Server.name, _membership(server_id, user.id).label("is_member"))
+        .where(Server.id == server_id)
+    )).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    if user not in server.members:
+    if not server.is_member:
         raise HTTPException(status_code=403, detail="Not a member")
 
-    invites = db.query(ServerInvite).filter(ServerInvite.server_id == server_id).all()
-    return [_build_invite_out(i) for i in invites]
+    rows = (await db.execute(
+        select(
+            ServerInvite.id, ServerInvite.server_id, ServerInvite.code, ServerInvite.expires_at,
+            ServerInvite.max_uses, ServerInvite.uses, ServerInvite.created_by, ServerInvite.created_at,
+        ).where(ServerInvite.server_id == server_id)
+    )).all()
+    return rows_response([{**r._asdict(), "server_name": server.name} for r in rows])
 
 
 @router.post("/join", response_model=ServerOut)
-def join_via_invite(
+async def join_via_invite(
     data: InviteJoin,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    invite = db.query(ServerInvite).filter(ServerInvite.code == data.code).first()
+    invite = await db.scalar(
+        select(ServerInvite).options(joinedload(ServerInvite.server)).where(ServerInvite.code == data.code)
+    )
     if not invite:
         raise HTTPException(status_code=404, detail="Invalid invite code")
 
@@ -93,40 +150,44 @@ def join_via_invite(
     server = invite.server
 
     # Check if banned
-    banned = db.query(BannedUser).filter(
+    banned = await db.scalar(select(exists().where(
         BannedUser.server_id == server.id, BannedUser.user_id == user.id
-    ).first()
+    )))
     if banned:
         raise HTTPException(status_code=403, detail="You are banned from this server")
 
     # Join if not already member
-    if user not in server.members:
-        server.members.append(user)
+    if not await _is_member(db, server.id, user.id):
+        await db.execute(insert(server_members).values(user_id=user.id, server_id=server.id))
         invite.uses += 1
-        db.commit()
+        await db.commit()
 
     return server
 
 
 @router.get("/info/{code}", response_model=InviteOut)
-def get_invite_info(
+async def get_invite_info(
     code: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    invite = db.query(ServerInvite).filter(ServerInvite.code == code).first()
+    invite = await db.scalar(
+        select(ServerInvite)
+        .options(*strict_loads(joinedload(ServerInvite.server)))
+        .where(ServerInvite.code == code)
+    )
     if not invite:
         raise HTTPException(status_code=404, detail="Invalid invite code")
     return _build_invite_out(invite)
 
 
 @router.delete("/{invite_id}")
-def delete_invite(
+async def delete_invite(
     invite_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    invite = db.query(ServerInvite).filter(ServerInvite.id == invite_id).first()
+    invite = await db.get(ServerInvite, invite_id, options=[joinedload(ServerInvite.server)])
     if not invite:
         raise HTTPException(status_code=404, detail="Invite not found")
 
@@ -134,6 +195,6 @@ def delete_invite(
     if server.owner_id != user.id and invite.created_by != user.id:
         raise HTTPException(status_code=403, detail="Only server owner or invite creator can delete")
 
-    db.delete(invite)
-    db.commit()
+    await db.delete(invite)
+    await db.commit()
     return {"detail": "Invite deleted"}
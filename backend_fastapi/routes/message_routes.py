@@ -1,17 +1,21 @@
 import os
+import asyncio
 import re
-import uuid
+import secrets
 import mimetypes
 import httpx
 from datetime import datetime, timezone, timedelta
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from functools import lru_cache
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, select, insert, delete, exists, case, tuple_
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
-from database import get_db
-from models import Message, Channel, Server, User, Reaction, PinnedMessage, Notification
-from schemas import MessageSend, MessageEdit, MessageOut, ReactionOut, PinnedMessageOut
+from database import get_db, strict_loads
+from models import Message, Channel, Server, User, Reaction, PinnedMessage, Notification, server_members
+from schemas import MessageSend, MessageEdit, MessageOut, PinnedMessageOut, rows_response
 from auth import get_current_user
+from file_uploads import validate_filename, write_upload
 
 router = APIRouter(prefix="/servers/{server_id}/channels/{channel_id}/messages", tags=["messages"])
 
@@ -20,133 +24,345 @@ UPLOADS_CHANNEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "
 # Keep old dir for backward compat serving
 ATTACHMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "attachments")
 
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-ALLOWED_EXTENSIONS = {
-    "png", "jpg", "jpeg", "gif", "webp", "svg",
-    "pdf", "doc", "docx", "xls", "xlsx", "ppt", "pptx",
-    "txt", "csv", "json", "xml",
-    "zip", "tar", "gz", "rar", "7z",
-    "mp3", "wav", "ogg", "mp4", "webm", "mov",
-}
+MESSAGE_PAGE_SIZE = 100
 
+# Relationships read by _build_message_out, loaded up front for message lists;
+# reactions come pre-aggregated from _get_reactions instead
+_MESSAGE_LOADS = strict_loads(selectinload(Message.user))
+# group_concat separator; usernames never contain control characters
+_USERNAME_SEP = "\x1f"
+_MENTION_RE = re.compile(r"@(\w+)")
 
-async def encrypt_message(channel_id: int, plaintext: str) -> str:
-    """Call the Rust encryption service to encrypt a message."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{RUST_SERVICE_URL}/encrypt",
-            json={"channel_id": channel_id, "message": plaintext},
-            timeout=5.0,
-        )
+# Shown in place of deleted messages; their stored ciphertext is cleared on delete
+DELETED_MESSAGE_TEXT = "This message was deleted"
+
+
+# Shared keep-alive pool to the Rust service, closed in the app lifespan
+rust_client = httpx.AsyncClient(
+    base_url=RUST_SERVICE_URL,
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+    timeout=5.0,
+)
+
+
+async def _encrypt_one(channel_id: int, plaintext: str) -> str:
+    resp = await rust_client.post(
+        "/encrypt",
+        json={"channel_id": channel_id, "message": plaintext},
+    )
     if resp.status_code != 200:
         raise HTTPException(status_code=502, detail="Encryption service error")
     return resp.json()["encrypted"]
 
 
+async def encrypt_messages_batch(channel_id: int, plaintexts: List[str]) -> List[str]:
+    """Encrypt several messages for one channel in a single service call."""
+    if not plaintexts:
+        return []
+    resp = await rust_client.post(
+        "/encrypt_batch",
+        json={"channel_id": channel_id, "messages": plaintexts},
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Encryption service error")
+    return resp.json()["encrypted"]
+
+
+class CryptoBatcher:
+    """Coalesces concurrent encrypt calls into one /encrypt_batch request per channel.
+
+    A submit waits at most max_delay for company; a burst of sends from many
+    handlers then costs one service round trip per channel instead of one each.
+    Until start() runs (e.g. scripts importing this module) calls go straight through.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_delay: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        await asyncio.gather(self._worker, *self._inflight, return_exceptions=True)
+        self._worker = None
+        # Anything still queued was never sent; fail it rather than hang its caller
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._fail(pending)
+
+    @staticmethod
+    def _fail(items: list):
+        for _, _, fut in items:
+            if not fut.done():
+                fut.set_exception(HTTPException(status_code=503, detail="Encryption service unavailable"))
+
+    async def submit(self, channel_id: int, plaintext: str) -> str:
+        if self._worker is None:
+            return await _encrypt_one(channel_id, plaintext)
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((channel_id, plaintext, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            try:
+                while len(batch) < self.max_batch_size:
+                    batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._fail(batch)
+                raise
+            groups: dict[int, list] = {}
+            for item in batch:
+                groups.setdefault(item[0], []).append(item)
+            # Dispatch without awaiting so the next window fills while these are in flight
+            for channel_id, items in groups.items():
+                task = asyncio.create_task(self._dispatch(channel_id, items))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+    @staticmethod
+    async def _dispatch(channel_id: int, items: list):
+        plaintexts = [p for _, p, _ in items]
+        try:
+            results = await encrypt_messages_batch(channel_id, plaintexts)
+        except Exception:
+            # Batch call failed: retry individually so one bad request can't fail its neighbours
+            results = await asyncio.gather(
+                *(_encrypt_one(channel_id, p) for p in plaintexts), return_exceptions=True
+            )
+        for (_, _, fut), result in zip(items, results):
+            if fut.done():
+                continue
+            if isinstance(result, BaseException):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+
+encrypt_batcher = CryptoBatcher()
+
+
+async def encrypt_message(channel_id: int, plaintext: str) -> str:
+    """Encrypt a message via the Rust service, batched with concurrent callers."""
+    return await encrypt_batcher.submit(channel_id, plaintext)
+
+
 async def decrypt_message(channel_id: int, encrypted: str) -> str:
     """Call the Rust encryption service to decrypt a message."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{RUST_SERVICE_URL}/decrypt",
-            json={"channel_id": channel_id, "encrypted": encrypted},
-            timeout=5.0,
-        )
+    resp = await rust_client.post(
+        "/decrypt",
+        json={"channel_id": channel_id, "encrypted": encrypted},
+    )
     if resp.status_code != 200:
         raise HTTPException(status_code=502, detail="Decryption service error")
     return resp.json()["message"]
 
 
-def _validate_file(filename: str, size: int):
-    """Validate file extension and size."""
-    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
-    if ext not in ALLOWED_EXTENSIONS:
-        raise HTTPException(status_code=400, detail=f"File type .{ext} not allowed")
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File must be under 10MB")
-    # Path traversal prevention
-    if "/" in filename or "\\" in filename or ".." in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
-
-
-def _get_reactions(db: Session, message_id: int) -> List[ReactionOut]:
-    """Get aggregated reactions for a message."""
-    reactions = db.query(Reaction).filter(Reaction.message_id == message_id).all()
-    emoji_map: dict[str, list[str]] = {}
-    for r in reactions:
-        emoji_map.setdefault(r.emoji, []).append(r.user.username)
-    return [ReactionOut(emoji=e, count=len(users), users=users) for e, users in emoji_map.items()]
-
-
-def _build_message_out(msg: Message, plaintext: str, db: Session) -> MessageOut:
-    """Build a MessageOut from a Message model instance."""
-    # Determine attachment URL based on where file is stored
-    attachment_url = None
-    if msg.attachment:
-        # Check if file is in new uploads dir or old attachments dir
-        new_path = os.path.join(UPLOADS_CHANNEL_DIR, msg.attachment)
-        if os.path.exists(new_path):
-            attachment_url = f"/uploads/channels/{msg.attachment}"
+async def decrypt_messages_batch(channel_id: int, ciphertexts: List[str]) -> List[Optional[str]]:
+    """Decrypt several messages in a single service call; None marks an entry that failed."""
+    if not ciphertexts:
+        return []
+    resp = await rust_client.post(
+        "/decrypt_batch",
+        json={"channel_id": channel_id, "encrypted": ciphertexts},
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Decryption service error")
+    return resp.json()["messages"]
+
+
+async def _decrypt_rows(channel_id: int, messages: List[Message]) -> List[Optional[str]]:
+    """Plaintexts aligned with messages; None for rows that couldn't be decrypted."""
+    ciphertexts = [m.encrypted_content for m in messages]
+    try:
+        return await decrypt_messages_batch(channel_id, ciphertexts)
+    except Exception:
+        # Batch call failed: fall back to per-message calls, issued concurrently over the shared pool
+        results = await asyncio.gather(
+            *(decrypt_message(channel_id, c) for c in ciphertexts), return_exceptions=True
+        )
+        return [None if isinstance(r, BaseException) else r for r in results]
+
+
+def _get_reactions(db: Session, message_ids: List[int]) -> dict[int, List[dict]]:
+    """Reactions for several messages, grouped by emoji in SQL; messages without any are omitted."""
+    if not message_ids:
+        return {}
+    rows = (
+        db.query(
+            Reaction.message_id,
+            Reaction.emoji,
+            func.count(),
+            func.group_concat(User.username, _USERNAME_SEP),
+        )
+        .join(User, User.id == Reaction.user_id)
+        .filter(Reaction.message_id.in_(message_ids))
+        .group_by(Reaction.message_id, Reaction.emoji)
+        # Emoji in the order they were first used on each message
+        .order_by(Reaction.message_id, func.min(Reaction.id))
+        .all()
+    )
+    result: dict[int, List[dict]] = {}
+    for message_id, emoji, count, users in rows:
+        result.setdefault(message_id, []).append(
+            {"emoji": emoji, "count": count, "users": users.split(_USERNAME_SEP)}
+        )
+    return result
+
+
+@lru_cache(maxsize=1)
+def _legacy_attachments() -> frozenset[str]:
+    """Files in the old attachments/ dir; nothing writes there any more, so one scan lasts the process."""
+    try:
+        return frozenset(os.listdir(ATTACHMENTS_DIR))
+    except FileNotFoundError:
+        return frozenset()
+
+
+def _message_row_builder(reactions_by_msg: dict[int, List[dict]]):
+    """Returns build(msg, plaintext) -> MessageOut-shaped dict, specialized for one listing.
+
+    Author fields are worked out once per distinct author and the page's reactions and the
+    legacy-attachment set are bound up front, so each row is only attribute reads and dict
+    lookups: no queries, no filesystem access.
+    """
+    legacy = _legacy_attachments()
+    authors: dict[int, tuple[str, Optional[str], Optional[str]]] = {}
+
+    def build(msg: Message, plaintext: str) -> dict:
+        author = authors.get(msg.user_id)
+        if author is None:
+            u = msg.user
+            author = authors[msg.user_id] = (
+                u.username, u.display_name, f"/avatars/{u.avatar}" if u.avatar else None,
+            )
+        attachment = msg.attachment
+        if not attachment:
+            attachment_url = None
+        elif attachment in legacy:
+            attachment_url = f"/attachments/{attachment}"
         else:
-            attachment_url = f"/attachments/{msg.attachment}"
-
-    return MessageOut(
-        id=msg.id,
-        content=plaintext,
-        channel_id=msg.channel_id,
-        user_id=msg.user_id,
-        username=msg.user.username,
-        display_name=msg.user.display_name,
-        avatar_url=f"/avatars/{msg.user.avatar}" if msg.user.avatar else None,
-        attachment_url=attachment_url,
-        attachment_name=msg.attachment_name,
-        attachment_size=msg.attachment_size,
-        attachment_mime=msg.attachment_mime,
-        is_deleted=msg.is_deleted,
-        edited_at=msg.edited_at,
-        reactions=_get_reactions(db, msg.id),
-        created_at=msg.created_at,
+            attachment_url = f"/uploads/channels/{attachment}"
+        return {
+            "id": msg.id,
+            "content": plaintext,
+            "channel_id": msg.channel_id,
+            "user_id": msg.user_id,
+            "username": author[0],
+            "display_name": author[1],
+            "avatar_url": author[2],
+            "attachment_url": attachment_url,
+            "attachment_name": msg.attachment_name,
+            "attachment_size": msg.attachment_size,
+            "attachment_mime": msg.attachment_mime,
+            "is_deleted": bool(msg.is_deleted),
+            "edited_at": msg.edited_at,
+            "reactions": reactions_by_msg.get(msg.id, []),
+            "created_at": msg.created_at,
+        }
+
+    return build
+
+
+def _message_dict(msg: Message, plaintext: str, reactions: List[dict]) -> dict:
+    """MessageOut-shaped dict for a single message."""
+    return _message_row_builder({msg.id: reactions})(msg, plaintext)
+
+
+def _build_message_out(msg: Message, plaintext: str, reactions: List[dict]) -> MessageOut:
+    """Build a MessageOut from a Message model instance and its aggregated reactions."""
+    return MessageOut(**_message_dict(msg, plaintext, reactions))
+
+
+def _get_message(db: Session, channel_id: int, message_id: int) -> Optional[Message]:
+    """Load one message with everything _build_message_out reads."""
+    return (
+        db.query(Message)
+        .options(*_MESSAGE_LOADS)
+        .filter(Message.id == message_id, Message.channel_id == channel_id)
+        .first()
+    )
+
+
+def _membership(server_id: int, user_id: int):
+    """EXISTS probe on the server_members primary key."""
+    return exists().where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
     )
 
 
 def _verify_channel_access(db: Session, server_id: int, channel_id: int, user: User):
     """Verify channel exists, belongs to server, and user is a member."""
-    channel = db.query(Channel).filter(
-        Channel.id == channel_id, Channel.server_id == server_id
-    ).first()
-    if not channel:
+    # Channel, its server and the membership probe come back in a single SELECT
+    row = (
+        db.query(Channel, _membership(server_id, user.id).label("is_member"))
+        .options(joinedload(Channel.server))
+        .filter(Channel.id == channel_id, Channel.server_id == server_id)
+        .first()
+    )
+    if not row:
         raise HTTPException(status_code=404, detail="Channel not found")
-    server = db.query(Server).filter(Server.id == server_id).first()
-    if user not in server.members:
+    channel, is_member = row
+    if not is_member:
         raise HTTPException(status_code=403, detail="Not a member")
-    return channel, server
+    return channel, channel.server
+
+
+def channel_access(
+    server_id: int,
+    channel_id: int,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+) -> tuple[Channel, Server]:
+    """Dependency form of _verify_channel_access; FastAPI resolves it once per request."""
+    return _verify_channel_access(db, server_id, channel_id, user)
 
 
-def _detect_mentions(content: str, db: Session, sender: User, channel_id: int, server: Server):
+def _detect_mentions(content: str, db: Session, sender: User, channel: Channel, server: Server):
     """Detect @username and @everyone mentions, create notifications."""
+    # Most messages (and file-only uploads) mention nobody; skip everything for them
+    if "@" not in content:
+        return
+
+    rows = []
     # @everyone - admin only
     if "@everyone" in content and sender.id == server.owner_id:
-        for member in server.members:
-            if member.id != sender.id:
-                db.add(Notification(
-                    user_id=member.id,
-                    type="mention",
-                    reference_id=channel_id,
-                    content=f"{sender.username} mentioned @everyone in #{db.query(Channel).get(channel_id).name}",
-                ))
-
-    # @username mentions
-    mentions = re.findall(r"@(\w+)", content)
-    for uname in set(mentions):
-        if uname == "everyone":
-            continue
-        mentioned = db.query(User).filter(User.username == uname).first()
-        if mentioned and mentioned.id != sender.id:
-            db.add(Notification(
-                user_id=mentioned.id,
-                type="mention",
-                reference_id=channel_id,
-                content=f"{sender.username} mentioned you in #{db.query(Channel).get(channel_id).name}",
-            ))
+        text = f"{sender.username} mentioned @everyone in #{channel.name}"
+        member_ids = db.query(server_members.c.user_id).filter(
+            server_members.c.server_id == server.id, server_members.c.user_id != sender.id
+        )
+        rows.extend(
+            {"user_id": member_id, "type": "mention", "reference_id": channel.id, "content": text}
+            for (member_id,) in member_ids
+        )
+
+    # @username mentions, resolved in one query
+    names = set(_MENTION_RE.findall(content)) - {"everyone"}
+    if names:
+        text = f"{sender.username} mentioned you in #{channel.name}"
+        mentioned_ids = db.query(User.id).filter(User.username.in_(names), User.id != sender.id)
+        rows.extend(
+            {"user_id": user_id, "type": "mention", "reference_id": channel.id, "content": text}
+            for (user_id,) in mentioned_ids
+        )
+
+    # One multi-row INSERT rather than an ORM object (and INSERT) per recipient
+    if rows:
+        db.execute(insert(Notification), rows)
 
 
 @router.post("/", response_model=MessageOut, status_code=201)
@@ -156,8 +372,9 @@ async def send_message(
     data: MessageSend,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
+    access: tuple[Channel, Server] = Depends(channel_access),
 ):
-    channel, server = _verify_channel_access(db, server_id, channel_id, user)
+    channel, server = access
 
     if channel.is_locked and server.owner_id != user.id:
         raise HTTPException(status_code=403, detail="Channel is locked")
@@ -171,43 +388,56 @@ async def send_message(
     )
     db.add(msg)
 
-    _detect_mentions(data.content, db, user, channel_id, server)
+    _detect_mentions(data.content, db, user, channel, server)
 
+    # Flush fills in id and defaults; build the response before commit expires them
+    db.flush()
+    out = _build_message_out(msg, data.content, [])
     db.commit()
-    db.refresh(msg)
-
-    return _build_message_out(msg, data.content, db)
+    return out
 
 
-@router.get("/", response_model=List[MessageOut])
+@router.get("/", response_model=List[MessageOut], dependencies=[Depends(channel_access)])
 async def get_messages(
     server_id: int,
     channel_id: int,
+    before: Optional[int] = Query(None, description="Return messages older than this message id"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MESSAGE_PAGE_SIZE),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    _verify_channel_access(db, server_id, channel_id, user)
-
-    messages = (
-        db.query(Message)
-        .filter(Message.channel_id == channel_id)
-        .order_by(Message.created_at.asc())
-        .limit(100)
-        .all()
-    )
+    """The newest `limit` messages (before the cursor, if given), oldest first.
+
+    A full page sets X-Next-Cursor to pass back as `before` for the next older page.
+    """
+    query = db.query(Message).options(*_MESSAGE_LOADS).filter(Message.channel_id == channel_id)
+    if before is not None:
+        # Keyset seek on (created_at, id) so deep pages cost the same as the first
+        cursor = db.query(Message.created_at, Message.id).filter(
+            Message.id == before, Message.channel_id == channel_id
+        ).first()
+        if not cursor:
+            raise HTTPException(status_code=404, detail="Cursor message not found")
+        query = query.filter(tuple_(Message.created_at, Message.id) < tuple_(*cursor))
+    page = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit).all()
+    messages = page[::-1]
+
+    live = [m for m in messages if not m.is_deleted]
+    plaintexts = dict(zip((m.id for m in live), await _decrypt_rows(channel_id, live)))
+    build = _message_row_builder(_get_reactions(db, [m.id for m in messages]))
 
     result = []
     for msg in messages:
         if msg.is_deleted:
-            plaintext = "This message was deleted"
+            plaintext = DELETED_MESSAGE_TEXT
         else:
-            try:
-                plaintext = await decrypt_message(channel_id, msg.encrypted_content)
-            except Exception:
+            plaintext = plaintexts[msg.id]
+            if plaintext is None:
                 plaintext = "[decryption error]"
-        result.append(_build_message_out(msg, plaintext, db))
+        result.append(build(msg, plaintext))
 
-    return result
+    headers = {"X-Next-Cursor": str(messages[0].id)} if len(page) == limit else None
+    return rows_response(result, headers=headers)
 
 
 @router.post("/upload", response_model=MessageOut, status_code=201)
@@ -218,9 +448,10 @@ async def send_message_with_file(
     file: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
+    access: tuple[Channel, Server] = Depends(channel_access),
 ):
     """Send a message with optional file attachment."""
-    channel, server = _verify_channel_access(db, server_id, channel_id, user)
+    channel, server = access
 
     if channel.is_locked and server.owner_id != user.id:
         raise HTTPException(status_code=403, detail="Channel is locked")
@@ -231,20 +462,17 @@ async def send_message_with_file(
     mime_type = None
 
     if file and file.filename:
-        contents = await file.read()
-        _validate_file(file.filename, len(contents))
+        ext = validate_filename(file.filename)
 
         os.makedirs(UPLOADS_CHANNEL_DIR, exist_ok=True)
 
-        ext = file.filename.rsplit(".", 1)[-1].lower() if "." in file.filename else "bin"
-        attachment_filename = f"{uuid.uuid4().hex}.{ext}"
+        # Stored under a random name; the original only lives in attachment_name
+        attachment_filename = f"{secrets.token_hex(16)}.{ext}"
         filepath = os.path.join(UPLOADS_CHANNEL_DIR, attachment_filename)
 
-        with open(filepath, "wb") as f:
-            f.write(contents)
-
+        # The whole copy runs in one worker thread so slow disks don't stall the event loop
+        file_size = await asyncio.to_thread(write_upload, file.file, filepath)
         original_filename = file.filename
-        file_size = len(contents)
         mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or "application/octet-stream"
 
     message_text = content.strip() if content else ""
@@ -260,42 +488,24 @@ async def send_message_with_file(
         attachment_mime=mime_type,
     )
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
 
-    _detect_mentions(message_text, db, user, channel_id, server)
-    db.commit()
-    db.refresh(msg)
+    _detect_mentions(message_text, db, user, channel, server)
 
-    out = _build_message_out(msg, message_text, db)
+    # One transaction for the message and its mentions; build the response before commit expires msg
+    db.flush()
+    out = _build_message_out(msg, message_text, [])
+    db.commit()
 
     # Broadcast to all WebSocket clients in this channel
     from ws_manager import manager
-    await manager.broadcast(channel_id, {
-        "type": "message",
-        "id": msg.id,
-        "content": message_text,
-        "channel_id": channel_id,
-        "user_id": user.id,
-        "username": user.username,
-        "display_name": user.display_name,
-        "avatar_url": out.avatar_url,
-        "attachment_url": out.attachment_url,
-        "attachment_name": msg.attachment_name,
-        "attachment_size": msg.attachment_size,
-        "attachment_mime": msg.attachment_mime,
-        "is_deleted": False,
-        "edited_at": None,
-        "reactions": [],
-        "created_at": msg.created_at.isoformat(),
-    })
+    await manager.broadcast(channel_id, {"type": "message", **out.model_dump()})
 
     return out
 
 
 # ── Message Editing ──
 
-@router.put("/{message_id}", response_model=MessageOut)
+@router.put("/{message_id}", response_model=MessageOut, dependencies=[Depends(channel_access)])
 async def edit_message(
     server_id: int,
     channel_id: int,
@@ -304,9 +514,7 @@ async def edit_message(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    _verify_channel_access(db, server_id, channel_id, user)
-
-    msg = db.query(Message).filter(Message.id == message_id, Message.channel_id == channel_id).first()
+    msg = _get_message(db, channel_id, message_id)
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
     if msg.user_id != user.id:
@@ -333,7 +541,7 @@ async def edit_message(
         "edited_at": msg.edited_at.isoformat(),
     })
 
-    return _build_message_out(msg, data.content, db)
+    return _build_message_out(msg, data.content, _get_reactions(db, [msg.id]).get(msg.id, []))
 
 
 # ── Message Deletion ──
@@ -345,10 +553,11 @@ async def delete_message(
     message_id: int,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
+    access: tuple[Channel, Server] = Depends(channel_access),
 ):
-    _, server = _verify_channel_access(db, server_id, channel_id, user)
+    _, server = access
 
-    msg = db.query(Message).filter(Message.id == message_id, Message.channel_id == channel_id).first()
+    msg = _get_message(db, channel_id, message_id)
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
@@ -359,10 +568,8 @@ async def delete_message(
     if msg.is_deleted:
         raise HTTPException(status_code=400, detail="Already deleted")
 
-    # Soft delete
-    deleted_text = "This message was deleted"
-    encrypted = await encrypt_message(channel_id, deleted_text)
-    msg.encrypted_content = encrypted
+    # Soft delete; read paths show DELETED_MESSAGE_TEXT for deleted rows, so there's nothing to encrypt
+    msg.encrypted_content = ""
     msg.is_deleted = True
     db.commit()
     db.refresh(msg)
@@ -373,12 +580,12 @@ async def delete_message(
         "message_id": msg.id,
     })
 
-    return _build_message_out(msg, deleted_text, db)
+    return _build_message_out(msg, DELETED_MESSAGE_TEXT, _get_reactions(db, [msg.id]).get(msg.id, []))
 
 
 # ── Emoji Reactions ──
 
-@router.post("/{message_id}/reactions")
+@router.post("/{message_id}/reactions", dependencies=[Depends(channel_access)])
 async def toggle_reaction(
     server_id: int,
     channel_id: int,
@@ -387,25 +594,31 @@ async def toggle_reaction(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    _verify_channel_access(db, server_id, channel_id, user)
-
-    msg = db.query(Message).filter(Message.id == message_id, Message.channel_id == channel_id).first()
-    if not msg:
+    found = db.scalar(select(exists().where(Message.id == message_id, Message.channel_id == channel_id)))
+    if not found:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    existing = db.query(Reaction).filter(
-        Reaction.user_id == user.id, Reaction.message_id == message_id, Reaction.emoji == emoji
-    ).first()
+    # This user's reaction (if any) and the emoji's total, in one query
+    existing, count = db.execute(
+        select(
+            func.max(case((Reaction.user_id == user.id, Reaction.id))),
+            func.count(Reaction.id),
+        ).where(Reaction.message_id == message_id, Reaction.emoji == emoji)
+    ).one()
 
     if existing:
-        db.delete(existing)
+        db.execute(delete(Reaction).where(Reaction.id == existing))
+        count -= 1
     else:
         db.add(Reaction(user_id=user.id, message_id=message_id, emoji=emoji))
+        count += 1
 
-    db.commit()
-
-    # Get updated count
-    count = db.query(Reaction).filter(Reaction.message_id == message_id, Reaction.emoji == emoji).count()
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent toggle added the same reaction first
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Reaction already added")
 
     from ws_manager import manager
     await manager.broadcast(channel_id, {
@@ -422,7 +635,7 @@ async def toggle_reaction(
 
 # ── Message Search ──
 
-@router.get("/search", response_model=List[MessageOut])
+@router.get("/search", response_model=List[MessageOut], dependencies=[Depends(channel_access)])
 async def search_messages(
     server_id: int,
     channel_id: int,
@@ -430,10 +643,9 @@ async def search_messages(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    _verify_channel_access(db, server_id, channel_id, user)
-
     messages = (
         db.query(Message)
+        .options(*_MESSAGE_LOADS)
         .filter(Message.channel_id == channel_id, Message.is_deleted == False)
         .order_by(Message.created_at.desc())
         .limit(200)
@@ -441,16 +653,13 @@ async def search_messages(
     )
 
     query_lower = q.lower()
-    result = []
-    for msg in messages:
-        try:
-            plaintext = await decrypt_message(channel_id, msg.encrypted_content)
-        except Exception:
-            continue
-        if query_lower in plaintext.lower():
-            result.append(_build_message_out(msg, plaintext, db))
-
-    return result[:50]  # Cap results
+    matches = [
+        (msg, plaintext)
+        for msg, plaintext in zip(messages, await _decrypt_rows(channel_id, messages))
+        if plaintext is not None and query_lower in plaintext.lower()
+    ][:50]  # Cap results
+    build = _message_row_builder(_get_reactions(db, [msg.id for msg, _ in matches]))
+    return rows_response([build(msg, plaintext) for msg, plaintext in matches])
 
 
 # ── Pinned Messages ──
@@ -462,8 +671,9 @@ async def pin_message(
     message_id: int,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
+    access: tuple[Channel, Server] = Depends(channel_access),
 ):
-    _, server = _verify_channel_access(db, server_id, channel_id, user)
+    _, server = access
 
     # Only server owner can pin in channels
     if server.owner_id != user.id:
@@ -490,10 +700,13 @@ async def pin_message(
     db.commit()
     db.refresh(pin)
 
-    try:
-        content = await decrypt_message(channel_id, msg.encrypted_content)
-    except Exception:
-        content = "[encrypted]"
+    if msg.is_deleted:
+        content = DELETED_MESSAGE_TEXT
+    else:
+        try:
+            content = await decrypt_message(channel_id, msg.encrypted_content)
+        except Exception:
+            content = "[encrypted]"
 
     from ws_manager import manager
     await manager.broadcast(channel_id, {
@@ -517,8 +730,9 @@ async def unpin_message(
     message_id: int,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
+    access: tuple[Channel, Server] = Depends(channel_access),
 ):
-    _, server = _verify_channel_access(db, server_id, channel_id, user)
+    _, server = access
 
     if server.owner_id != user.id:
         raise HTTPException(status_code=403, detail="Only server owner can unpin messages")
@@ -541,36 +755,41 @@ async def unpin_message(
     return {"detail": "Message unpinned"}
 
 
-@router.get("/pinned", response_model=List[PinnedMessageOut])
+@router.get("/pinned", response_model=List[PinnedMessageOut], dependencies=[Depends(channel_access)])
 async def get_pinned_messages(
     server_id: int,
     channel_id: int,
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    _verify_channel_access(db, server_id, channel_id, user)
-
     pins = (
         db.query(PinnedMessage)
+        .options(*strict_loads(
+            selectinload(PinnedMessage.message).selectinload(Message.user),
+            selectinload(PinnedMessage.pinner),
+        ))
         .filter(PinnedMessage.channel_id == channel_id)
         .order_by(PinnedMessage.pinned_at.desc())
         .all()
     )
 
+    pins = [pin for pin in pins if pin.message]
+    live = [pin.message for pin in pins if not pin.message.is_deleted]
+    plaintexts = dict(zip((m.id for m in live), await _decrypt_rows(channel_id, live)))
+
     result = []
     for pin in pins:
         msg = pin.message
-        if not msg:
-            continue
-        try:
-            content = await decrypt_message(channel_id, msg.encrypted_content)
-        except Exception:
-            content = "[encrypted]"
-        result.append(PinnedMessageOut(
-            id=pin.id, message_id=msg.id, pinned_by=pin.pinned_by,
-            pinned_by_username=pin.pinner.username, pinned_at=pin.pinned_at,
-            content=content, author_username=msg.user.username,
-            author_display_name=msg.user.display_name,
-        ))
-
-    return result
+        if msg.is_deleted:
+            content = DELETED_MESSAGE_TEXT
+        else:
+            content = plaintexts[msg.id]
+            if content is None:
+                content = "[encrypted]"
+        result.append({
+            "id": pin.id, "message_id": msg.id, "dm_message_id": None, "pinned_by": pin.pinned_by,
+            "pinned_by_username": pin.pinner.username, "pinned_at": pin.pinned_at,
+            "content": content, "author_username": msg.user.username,
+            "author_display_name": msg.user.display_name,
+        })
+    return rows_response(result)
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import delete, exists, update
 from typing import List
-from database import get_db
+from database import get_db, strict_loads
 from models import Server, User, BannedUser, Channel, Message, server_members
-from schemas import KickRequest, BanRequest, BannedUserOut
+from schemas import KickRequest, BanRequest, BannedUserOut, rows_response
 from auth import get_current_user
 
 router = APIRouter(prefix="/servers/{server_id}/mod", tags=["moderation"])
@@ -18,6 +19,19 @@ def _require_owner(db: Session, server_id: int, user: User) -> Server:
     return server
 
 
+def _is_member(db: Session, server_id: int, user_id: int) -> bool:
+    """Single index probe on server_members instead of loading server.members."""
+    return db.query(exists().where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
+    )).scalar()
+
+
+def _remove_member(db: Session, server_id: int, user_id: int):
+    db.execute(delete(server_members).where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
+    ))
+
+
 # ── Kick member ──
 
 @router.post("/kick")
@@ -27,16 +41,16 @@ def kick_member(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    server = _require_owner(db, server_id, user)
+    _require_owner(db, server_id, user)
 
     if data.user_id == user.id:
         raise HTTPException(status_code=400, detail="Cannot kick yourself")
 
     target = db.query(User).filter(User.id == data.user_id).first()
-    if not target or target not in server.members:
+    if not target or not _is_member(db, server_id, target.id):
         raise HTTPException(status_code=404, detail="User not a member")
 
-    server.members.remove(target)
+    _remove_member(db, server_id, target.id)
     db.commit()
     return {"detail": f"{target.username} kicked from server"}
 
@@ -50,7 +64,7 @@ def ban_member(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    server = _require_owner(db, server_id, user)
+    _require_owner(db, server_id, user)
 
     if data.user_id == user.id:
         raise HTTPException(status_code=400, detail="Cannot ban yourself")
@@ -73,14 +87,12 @@ def ban_member(
     )
     db.add(ban)
 
-    # Remove from members
-    if target in server.members:
-        server.members.remove(target)
-
-    db.commit()
-    db.refresh(ban)
+    # Remove from members (a no-op if they already left)
+    _remove_member(db, server_id, target.id)
 
-    return BannedUserOut(
+    # Flush fills in id and banned_at; build the response before commit expires them
+    db.flush()
+    out = BannedUserOut(
         id=ban.id,
         user_id=ban.user_id,
         username=target.username,
@@ -88,6 +100,8 @@ def ban_member(
         reason=ban.reason,
         banned_at=ban.banned_at,
     )
+    db.commit()
+    return out
 
 
 # ── Unban ──
@@ -122,18 +136,23 @@ def list_bans(
 ):
     _require_owner(db, server_id, user)
 
-    bans = db.query(BannedUser).filter(BannedUser.server_id == server_id).all()
-    return [
-        BannedUserOut(
-            id=b.id,
-            user_id=b.user_id,
-            username=b.user.username,
-            banned_by=b.banned_by,
-            reason=b.reason,
-            banned_at=b.banned_at,
-        )
+    bans = (
+        db.query(BannedUser)
+        .options(*strict_loads(joinedload(BannedUser.user)))
+        .filter(BannedUser.server_id == server_id)
+        .all()
+    )
+    return rows_response([
+        {
+            "id": b.id,
+            "user_id": b.user_id,
+            "username": b.user.username,
+            "banned_by": b.banned_by,
+            "reason": b.reason,
+            "banned_at": b.banned_at,
+        }
         for b in bans
-    ]
+    ])
 
 
 # ── Lock / Unlock channel ──
@@ -196,33 +215,28 @@ async def purge_user_messages(
     if not channel:
         raise HTTPException(status_code=404, detail="Channel not found")
 
-    from routes.message_routes import encrypt_message
-    deleted_text = "This message was deleted"
-    encrypted = await encrypt_message(channel_id, deleted_text)
-
-    msgs = db.query(Message).filter(
-        Message.channel_id == channel_id,
-        Message.user_id == target_user_id,
-        Message.is_deleted == False,
+    # One UPDATE; RETURNING hands back the ids to broadcast without loading rows.
+    # Deleted rows are shown as DELETED_MESSAGE_TEXT, so their ciphertext is just cleared.
+    purged_ids = db.scalars(
+        update(Message)
+        .where(
+            Message.channel_id == channel_id,
+            Message.user_id == target_user_id,
+            Message.is_deleted == False,
+        )
+        .values(is_deleted=True, encrypted_content="")
+        .returning(Message.id)
     ).all()
 
-    count = 0
-    for msg in msgs:
-        msg.is_deleted = True
-        msg.encrypted_content = encrypted
-        count += 1
-
     db.commit()
 
     # Broadcast deletions via WS
     from ws_manager import manager
-    for msg in msgs:
-        await manager.broadcast(channel_id, {
-            "type": "message_deleted",
-            "message_id": msg.id,
-        })
+    await manager.broadcast_many(channel_id, [
+        {"type": "message_deleted", "message_id": message_id} for message_id in purged_ids
+    ])
 
-    return {"detail": f"{count} messages purged"}
+    return {"detail": f"{len(purged_ids)} messages purged"}
 
 
 # ── Get server members (for moderation UI) ──
@@ -236,7 +250,8 @@ def list_members(
     server = db.query(Server).filter(Server.id == server_id).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    if user not in server.members:
+    # Probe membership first so non-members never trigger the full members load below
+    if not _is_member(db, server_id, user.id):
         raise HTTPException(status_code=403, detail="Not a member")
 
     return [
@@ -1,38 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import tuple_
+from typing import List, Optional
 from database import get_db
 from models import Notification, User
-from schemas import NotificationOut
+from schemas import NotificationOut, rows_response
 from auth import get_current_user
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+NOTIFICATION_PAGE_SIZE = 50
+
 
 @router.get("/", response_model=List[NotificationOut])
 def get_notifications(
+    before: Optional[int] = Query(None, description="Return notifications older than this notification id"),
+    limit: int = Query(NOTIFICATION_PAGE_SIZE, ge=1, le=100),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    notifs = (
-        db.query(Notification)
-        .filter(Notification.user_id == user.id)
-        .order_by(Notification.created_at.desc())
-        .limit(50)
-        .all()
-    )
-    return [
-        NotificationOut(
-            id=n.id,
-            user_id=n.user_id,
-            type=n.type,
-            reference_id=n.reference_id,
-            content=n.content,
-            is_read=n.is_read,
-            created_at=n.created_at,
-        )
+    """Newest first; a full page sets X-Next-Cursor to pass back as `before`."""
+    query = db.query(Notification).filter(Notification.user_id == user.id)
+    if before is not None:
+        cursor = db.query(Notification.created_at, Notification.id).filter(
+            Notification.id == before, Notification.user_id == user.id
+        ).first()
+        if not cursor:
+            raise HTTPException(status_code=404, detail="Cursor notification not found")
+        query = query.filter(tuple_(Notification.created_at, Notification.id) < tuple_(*cursor))
+    notifs = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit).all()
+    headers = {"X-Next-Cursor": str(notifs[-1].id)} if len(notifs) == limit else None
+    return rows_response([
+        {
+            "id": n.id,
+            "user_id": n.user_id,
+            "type": n.type,
+            "reference_id": n.reference_id,
+            "content": n.content,
+            "is_read": bool(n.is_read),
+            "created_at": n.created_at,
+        }
         for n in notifs
-    ]
+    ], headers=headers)
 
 
 @router.get("/unread-count")
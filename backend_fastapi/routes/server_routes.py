@@ -1,70 +1,118 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, exists, insert
+from sqlalchemy.exc import IntegrityError
 from typing import List
-from database import get_db
-from models import Server, Channel, User, BannedUser
-from schemas import ServerCreate, ServerOut
+from database import get_async_db, strict_loads
+from models import Server, Channel, User, BannedUser, server_members
+from schemas import ServerCreate, ServerOut, ServerBrowseOut, SERVER_LIST_ADAPTER, rows_response
 from auth import get_current_user
 
 router = APIRouter(prefix="/servers", tags=["servers"])
 
+BROWSE_CACHE_TTL = 30  # seconds
+# (ServerOut rows, encoded JSON) for GET /servers/browse; create_server drops it
+_browse_cache: TTLCache = TTLCache(maxsize=1, ttl=BROWSE_CACHE_TTL)
+
+
+def _membership(server_id: int, user_id: int):
+    """EXISTS probe on the server_members primary key."""
+    return exists().where(
+        server_members.c.server_id == server_id, server_members.c.user_id == user_id
+    )
+
+
+async def _all_servers(db: AsyncSession) -> tuple[list[dict], bytes]:
+    """Every server as ServerOut rows plus their encoded JSON, cached for BROWSE_CACHE_TTL."""
+    cached = _browse_cache.get("all")
+    if cached is None:
+        servers = (await db.scalars(select(Server).options(*strict_loads()))).all()
+        out = SERVER_LIST_ADAPTER.validate_python(servers, from_attributes=True)
+        cached = ([s.model_dump() for s in out], SERVER_LIST_ADAPTER.dump_json(out))
+        _browse_cache["all"] = cached
+    return cached
+
 
 @router.post("/", response_model=ServerOut, status_code=201)
-def create_server(
+async def create_server(
     data: ServerCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     server = Server(name=data.name, owner_id=user.id)
-    server.members.append(user)
     db.add(server)
-    db.commit()
-    db.refresh(server)
+    await db.flush()
+    await db.execute(insert(server_members).values(user_id=user.id, server_id=server.id))
 
     # Auto-create a #general channel
-    general = Channel(name="general", server_id=server.id)
-    db.add(general)
-    db.commit()
+    db.add(Channel(name="general", server_id=server.id))
+    await db.commit()
+    _browse_cache.clear()
 
     return server
 
 
 @router.get("/", response_model=List[ServerOut])
-def list_servers(
-    db: Session = Depends(get_db),
+async def list_servers(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    return user.servers
+    # user comes from the sync session; read the memberships here instead of lazy-loading user.servers
+    rows = (await db.execute(
+        select(Server.id, Server.name, Server.owner_id)
+        .join(server_members, server_members.c.server_id == Server.id)
+        .where(server_members.c.user_id == user.id)
+    )).all()
+    return rows_response([r._asdict() for r in rows])
 
 
-@router.get("/browse", response_model=List[ServerOut])
-def browse_servers(
-    db: Session = Depends(get_db),
+@router.get("/browse", response_model=List[ServerBrowseOut])
+async def browse_servers(
+    with_joined: bool = Query(False),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    """List all servers so users can discover and join them."""
-    return db.query(Server).all()
+    """List all servers so users can discover and join them.
+
+    with_joined adds a per-user `joined` flag, so a page needs no separate /servers/ call.
+    The server list is shared and cached; only the user's memberships are read per request.
+    """
+    rows, encoded = await _all_servers(db)
+    if not with_joined:
+        return Response(content=encoded, media_type="application/json")
+
+    joined = set((await db.scalars(
+        select(server_members.c.server_id).where(server_members.c.user_id == user.id)
+    )).all())
+    return rows_response([{**r, "joined": r["id"] in joined} for r in rows])
 
 
 @router.post("/{server_id}/join", response_model=ServerOut)
-def join_server(
+async def join_server(
     server_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    server = db.query(Server).filter(Server.id == server_id).first()
-    if not server:
+    # The server row, the ban check and the membership check in one query
+    row = (await db.execute(
+        select(
+            Server.id, Server.name, Server.owner_id,
+            exists().where(BannedUser.server_id == server_id, BannedUser.user_id == user.id).label("banned"),
+            _membership(server_id, user.id).label("is_member"),
+        ).where(Server.id == server_id)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Server not found")
-
-    # Check if banned
-    banned = db.query(BannedUser).filter(
-        BannedUser.server_id == server_id, BannedUser.user_id == user.id
-    ).first()
-    if banned:
+    if row.banned:
         raise HTTPException(status_code=403, detail="You are banned from this server")
 
-    if user not in server.members:
-        server.members.append(user)
-        db.commit()
-        db.refresh(server)
-    return server
+    out = ServerOut(id=row.id, name=row.name, owner_id=row.owner_id)
+    if not row.is_member:
+        try:
+            await db.execute(insert(server_members).values(user_id=user.id, server_id=server_id))
+            await db.commit()
+        except IntegrityError:
+            # A concurrent join (another tab, or an invite) added the membership first
+            await db.rollback()
+    return out
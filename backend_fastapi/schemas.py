@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 
 # ── Auth ──
@@ -67,6 +68,12 @@ class ServerOut(BaseModel):
     class Config:
         from_attributes = True
 
+class ServerBrowseOut(ServerOut):
+    joined: Optional[bool] = None  # only filled in with ?with_joined=true
+
+# Built once; validates ORM rows and encodes the list in pydantic-core
+SERVER_LIST_ADAPTER = TypeAdapter(List[ServerOut])
+
 
 # ── Channels ──
 
@@ -113,7 +120,7 @@ class MessageOut(BaseModel):
     attachment_mime: Optional[str] = None
     is_deleted: bool = False
     edited_at: Optional[datetime] = None
-    reactions: List[ReactionOut] = []
+    reactions: Tuple[ReactionOut, ...] = ()  # immutable default: nothing to copy per instance
     created_at: datetime
 
     class Config:
@@ -147,7 +154,7 @@ class DMMessageOut(BaseModel):
     attachment_mime: Optional[str] = None
     is_deleted: bool = False
     edited_at: Optional[datetime] = None
-    reactions: List[ReactionOut] = []
+    reactions: Tuple[ReactionOut, ...] = ()
     created_at: datetime
 
 
@@ -258,3 +265,12 @@ class BannedUserOut(BaseModel):
     banned_by: int
     reason: Optional[str] = None
     banned_at: datetime
+
+
+def rows_response(rows: list, headers: dict | None = None) -> ORJSONResponse:
+    """Return list rows that are already built to the endpoint's response_model shape.
+
+    List endpoints assemble plain dicts carrying exactly their Out schema's fields;
+    returning a response directly skips FastAPI's re-validation of every row.
+    """
+    return ORJSONResponse(rows, headers=headers)
@@ -1,53 +1,316 @@
 """Shared WebSocket connection managers for channels and DMs."""
 
+import asyncio
+import logging
+import os
+import time
 from collections import defaultdict
+
+import orjson
 from fastapi import WebSocket
 
+TYPING_THROTTLE = 3.0  # seconds
+SEND_TIMEOUT = 5.0  # seconds a socket's writer waits on one send before dropping the client
+# Set to relay broadcasts and direct notifications through Redis pub/sub, so every
+# uvicorn worker reaches its own sockets. Presence stays per worker.
+REDIS_URL = os.getenv("REDIS_URL")
+NOTIFY_TOPIC = "freecord:notify"
+BUS_RETRY_MAX = 30.0  # seconds between resubscribe attempts after a Redis error, at most
+
+logger = logging.getLogger("freecord")
+
 
 class ConnectionManager:
     """Manages WebSocket connections per channel/conversation."""
 
-    def __init__(self):
-        # key -> list of (websocket, user_id, username)
-        self.channels: dict[int, list[tuple[WebSocket, int, str]]] = defaultdict(list)
+    def __init__(self, topic: str):
+        # key -> {websocket: (user_id, username)}; a key is dropped once its last socket leaves
+        self.channels: dict[int, dict[WebSocket, tuple[int, str]]] = defaultdict(dict)
+        # (user_id, key) -> monotonic time of the last forwarded typing_start
+        self.last_typing: dict[tuple[int, int], float] = {}
+        # Redis pub/sub topic shared by this manager on every worker
+        self.topic = topic
+        # Redis client while the cross-worker bus runs; None keeps broadcasts in-process
+        self.bus = None
 
     async def connect(self, ws: WebSocket, channel_id: int, user_id: int, username: str):
         await ws.accept()
-        self.channels[channel_id].append((ws, user_id, username))
+        self.channels[channel_id][ws] = (user_id, username)
+        _open_outbox(ws)
 
     def disconnect(self, ws: WebSocket, channel_id: int):
-        self.channels[channel_id] = [
-            (w, uid, uname) for w, uid, uname in self.channels[channel_id] if w != ws
-        ]
+        conns = self.channels.get(channel_id)
+        if conns is None:
+            return
+        conns.pop(ws, None)
+        if not conns:
+            del self.channels[channel_id]
+        _close_outbox(ws)
 
     async def broadcast(self, channel_id: int, message: dict):
-        dead = []
-        for ws, uid, uname in self.channels[channel_id]:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            self.disconnect(ws, channel_id)
+        await self.broadcast_raw(channel_id, orjson.dumps(message).decode())
+
+    async def broadcast_raw(self, channel_id: int, payload: str):
+        """Send an already-serialized JSON payload to every client in a channel."""
+        await self._publish(channel_id, (payload,))
+
+    async def broadcast_many(self, channel_id: int, messages: list[dict]):
+        """Broadcast several events; each client gets them in order, clients are served concurrently."""
+        await self.broadcast_many_raw(channel_id, [orjson.dumps(m).decode() for m in messages])
+
+    async def broadcast_many_raw(self, channel_id: int, payloads: list[str]):
+        if payloads:
+            await self._publish(channel_id, payloads)
 
     async def broadcast_except(self, channel_id: int, message: dict, exclude_user_id: int):
         """Broadcast to all clients in a channel EXCEPT the specified user."""
+        await self.broadcast_except_raw(channel_id, orjson.dumps(message).decode(), exclude_user_id)
+
+    async def broadcast_except_raw(self, channel_id: int, payload: str, exclude_user_id: int):
+        await self._publish(channel_id, (payload,), exclude_user_id)
+
+    def allow_typing(self, channel_id: int, user_id: int, msg_type: str) -> bool:
+        """Drop repeated typing_start events from the same user within TYPING_THROTTLE seconds."""
+        key = (user_id, channel_id)
+        if msg_type == "typing_stop":
+            self.last_typing.pop(key, None)
+            return True
+        now = time.monotonic()
+        if now - self.last_typing.get(key, 0.0) < TYPING_THROTTLE:
+            return False
+        self.last_typing[key] = now
+        return True
+
+    async def _publish(self, channel_id: int, payloads, exclude_user_id: int | None = None):
+        """Deliver to this worker's sockets, or through Redis to the sockets on every worker.
+
+        If Redis is unreachable the event still reaches this worker's sockets; callers
+        have usually committed already, so a publish error never propagates.
+        """
+        if self.bus is not None:
+            try:
+                await self.bus.publish(self.topic, orjson.dumps((channel_id, exclude_user_id, payloads)))
+                return
+            except Exception:
+                logger.exception("Redis publish on %s failed; delivering on this worker only", self.topic)
+        self._deliver(channel_id, payloads, exclude_user_id)
+
+    def _deliver(self, channel_id: int, payloads, exclude_user_id: int | None):
+        """Queue encoded payloads on each socket's outbox; never waits on a client.
+
+        Each socket's writer sends them in order. One broadcast takes one outbox slot
+        however many payloads it carries, and the payloads are shared by every socket.
+        A client whose outbox is full has fallen OUTBOX_SIZE broadcasts behind: it is
+        dropped and closed rather than buffering without bound.
+        """
+        conns = self.channels.get(channel_id)
+        if not conns:
+            return
+        item = payloads[0] if len(payloads) == 1 else tuple(payloads)
         dead = []
-        for ws, uid, uname in self.channels[channel_id]:
+        for ws, (uid, _) in conns.items():
             if uid == exclude_user_id:
                 continue
+            entry = _outboxes.get(ws)
+            if entry is None:
+                continue
             try:
-                await ws.send_json(message)
-            except Exception:
+                entry[0].put_nowait(item)
+            except asyncio.QueueFull:
                 dead.append(ws)
         for ws in dead:
             self.disconnect(ws, channel_id)
+            _close_later(ws)
+
+    def _on_bus_event(self, event):
+        channel_id, exclude_user_id, payloads = event
+        self._deliver(channel_id, payloads, exclude_user_id)
+
+
+# Close tasks for dropped sockets and pending notification publishes, referenced until they finish
+_closing: set[asyncio.Task] = set()
+
+
+def _keep_until_done(task: asyncio.Task):
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+async def _close_quietly(ws: WebSocket):
+    try:
+        await asyncio.wait_for(ws.close(code=1011), SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+def _close_later(ws: WebSocket):
+    """Close a stalled socket in the background; its handler's receive loop then cleans up."""
+    _keep_until_done(asyncio.create_task(_close_quietly(ws)))
 
 
 # Singleton instances — import these in route files and main.py
-manager = ConnectionManager()
-dm_manager = ConnectionManager()
+manager = ConnectionManager("freecord:channels")
+dm_manager = ConnectionManager("freecord:dms")
+
+# Pump tasks (channels, DMs, notifications) while the Redis bus runs
+_bus_pumps: list[asyncio.Task] = []
+
+
+async def _pump(client, topic: str, handle):
+    """Hand every event published on topic, by any worker, to handle in order.
+
+    A dropped Redis connection is logged and the topic resubscribed with backoff;
+    events published while it is down are lost to this worker.
+    """
+    delay = 1.0
+    while True:
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(topic)
+            delay = 1.0
+            async for msg in pubsub.listen():
+                if msg["type"] == "message":
+                    handle(orjson.loads(msg["data"]))
+        except Exception:
+            logger.exception("Redis bus on %s failed; resubscribing in %.0fs", topic, delay)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BUS_RETRY_MAX)
+
+
+async def start_bus():
+    """Route broadcasts and notifications through Redis when REDIS_URL is set (multi-worker runs)."""
+    if not REDIS_URL:
+        return
+    from redis import asyncio as aioredis  # only needed when the bus is on
+
+    client = aioredis.from_url(REDIS_URL)
+    for mgr in (manager, dm_manager):
+        mgr.bus = client
+    _bus_pumps.extend(
+        asyncio.create_task(_pump(client, topic, handle))
+        for topic, handle in (
+            (manager.topic, manager._on_bus_event),
+            (dm_manager.topic, dm_manager._on_bus_event),
+            (NOTIFY_TOPIC, _deliver_notifications),
+        )
+    )
+
+
+async def stop_bus():
+    client = manager.bus
+    manager.bus = dm_manager.bus = None
+    for task in _bus_pumps:
+        task.cancel()
+    await asyncio.gather(*_bus_pumps, return_exceptions=True)
+    _bus_pumps.clear()
+    if client is not None:
+        await client.aclose()
 
 # Track all connected user websockets globally (for status updates)
 # user_id -> set of WebSocket objects
 connected_users: dict[int, set[WebSocket]] = defaultdict(set)
+
+# Last status written for each user, so reconnect flaps don't rewrite/rebroadcast it
+# user_id -> "online" | "idle" | "dnd" | "offline"
+last_status: dict[int, str] = {}
+
+
+# Broadcasts and direct notifications queued per socket before it counts as stalled
+OUTBOX_SIZE = 256
+# WebSocket -> (outbox, writer task) for every open socket. An outbox item is one
+# encoded payload, or a tuple of them from a single broadcast_many.
+_outboxes: dict[WebSocket, tuple[asyncio.Queue, asyncio.Task]] = {}
+
+
+async def _outbox_writer(ws: WebSocket, outbox: asyncio.Queue):
+    """Drain one socket's frames in order; stops at the first failed or stalled send."""
+    while True:
+        item = await outbox.get()
+        try:
+            for payload in (item,) if isinstance(item, str) else item:
+                await asyncio.wait_for(ws.send_text(payload), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            _close_later(ws)
+            return
+        except Exception:
+            return  # the socket's own handler unregisters it on disconnect
+
+
+def _open_outbox(ws: WebSocket):
+    """Start the single writer that serves everything sent to this socket."""
+    if ws not in _outboxes:
+        outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        _outboxes[ws] = (outbox, asyncio.create_task(_outbox_writer(ws, outbox)))
+
+
+def _close_outbox(ws: WebSocket):
+    entry = _outboxes.pop(ws, None)
+    if entry:
+        entry[1].cancel()
+
+
+def register_user_socket(user_id: int, ws: WebSocket):
+    """Track a user's socket for status updates and direct notifications."""
+    connected_users[user_id].add(ws)
+    _open_outbox(ws)
+
+
+def unregister_user_socket(user_id: int, ws: WebSocket):
+    """Forget a user's socket and stop its writer. Safe to call more than once."""
+    connected_users[user_id].discard(ws)
+    _close_outbox(ws)
+
+
+def notify_users(items: list[tuple[int, dict]]):
+    """Queue each (user_id, payload) on all of that user's sockets, on every worker.
+
+    Never awaits: each socket's writer sends in the background, and with the Redis
+    bus on the publish runs as a background task. Must be called from the event
+    loop thread (async routes), since asyncio queues aren't thread-safe.
+    """
+    bus = manager.bus
+    if bus is None:
+        # Encode once per payload, not once per socket, and only for users connected here
+        _deliver_notifications([
+            (user_id, orjson.dumps(payload).decode()) for user_id, payload in items if connected_users.get(user_id)
+        ])
+    elif items:
+        encoded = [(user_id, orjson.dumps(payload).decode()) for user_id, payload in items]
+        _keep_until_done(asyncio.create_task(_publish_notifications(bus, encoded)))
+
+
+async def _publish_notifications(bus, encoded: list[tuple[int, str]]):
+    try:
+        await bus.publish(NOTIFY_TOPIC, orjson.dumps(encoded))
+    except Exception:
+        logger.exception("Redis publish on %s failed; notifying on this worker only", NOTIFY_TOPIC)
+        _deliver_notifications(encoded)
+
+
+def _deliver_notifications(encoded):
+    """Queue (user_id, encoded payload) pairs on this worker's sockets for each user."""
+    for user_id, text in encoded:
+        for ws in list(connected_users.get(user_id, ())):
+            entry = _outboxes.get(ws)
+            if entry is None:
+                continue
+            try:
+                entry[0].put_nowait(text)
+            except asyncio.QueueFull:
+                pass  # a client this far behind misses the live event, not the stored state
+
+
+def send_to_socket(ws: WebSocket, payload: str):
+    """Queue an encoded payload for one socket; dropped if the socket is gone or stalled."""
+    entry = _outboxes.get(ws)
+    if entry is None:
+        return
+    try:
+        entry[0].put_nowait(payload)
+    except asyncio.QueueFull:
+        pass
@@ -1,7 +1,12 @@
 import os
+from http.cookiejar import DefaultCookiePolicy
 from dotenv import load_dotenv
 load_dotenv()
 
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, render_template, request, redirect, url_for, session, flash
 
 app = Flask(__name__)
@@ -9,6 +14,32 @@ app.secret_key = os.getenv("FLASK_SECRET", "flask-secret-change-me")
 
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 
+# One keep-alive connection pool to the backend, shared by every view
+api_session = requests.Session()
+# Shared across users, so never keep cookies between calls (auth is per-request Bearer headers)
+api_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+api_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+api_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+
+# Page views read several independent backend endpoints; fetch them side by side
+_backend_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="backend")
+
+
+def _json_or(resp, default):
+    """Body of a 200 response decoded with orjson, else default."""
+    return orjson.loads(resp.content) if resp.status_code == 200 else default
+
+
+def _get_all(headers, *paths):
+    """GET each API path concurrently; responses come back in argument order.
+
+    The last path is fetched on the calling thread, which would otherwise just wait.
+    """
+    *rest, last = paths
+    futures = [_backend_pool.submit(api_session.get, f"{API_URL}{p}", headers=headers) for p in rest]
+    last_resp = api_session.get(f"{API_URL}{last}", headers=headers)
+    return [f.result() for f in futures] + [last_resp]
+
 
 @app.route("/")
 def index():
@@ -20,27 +51,26 @@ def index():
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        import requests as req
         username = request.form["username"]
         password = request.form["password"]
 
-        resp = req.post(f"{API_URL}/auth/login", json={
+        resp = api_session.post(f"{API_URL}/auth/login", json={
             "username": username,
             "password": password,
         })
 
         if resp.status_code == 200:
-            data = resp.json()
+            data = orjson.loads(resp.content)
             session["token"] = data["access_token"]
             session["username"] = username
 
             # Fetch profile to store user_id in session
-            profile_resp = req.get(
+            profile_resp = api_session.get(
                 f"{API_URL}/auth/profile",
                 headers={"Authorization": f"Bearer {data['access_token']}"},
             )
             if profile_resp.status_code == 200:
-                session["user_id"] = profile_resp.json()["id"]
+                session["user_id"] = orjson.loads(profile_resp.content)["id"]
 
             return redirect(url_for("dashboard"))
         else:
@@ -52,11 +82,10 @@ def login():
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
-        import requests as req
         username = request.form["username"]
         password = request.form["password"]
 
-        resp = req.post(f"{API_URL}/auth/register", json={
+        resp = api_session.post(f"{API_URL}/auth/register", json={
             "username": username,
             "password": password,
         })
@@ -66,7 +95,7 @@ def register():
             return redirect(url_for("login"))
         else:
             try:
-                error = resp.json().get("detail", "Registration failed")
+                error = orjson.loads(resp.content).get("detail", "Registration failed")
             except Exception:
                 error = "Registration failed"
             flash(error, "error")
@@ -79,20 +108,12 @@ def dashboard():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
-    resp = req.get(f"{API_URL}/servers/", headers=headers)
-
-    servers = resp.json() if resp.status_code == 200 else []
-
-    # Fetch all servers for the browse/discover list
-    browse_resp = req.get(f"{API_URL}/servers/browse", headers=headers)
-    all_servers = browse_resp.json() if browse_resp.status_code == 200 else []
-
-    # Mark which ones the user already joined
-    joined_ids = {s["id"] for s in servers}
-    for s in all_servers:
-        s["joined"] = s["id"] in joined_ids
+    # All servers for the browse/discover list, each flagged with whether the user joined it
+    browse_resp = api_session.get(f"{API_URL}/servers/browse", params={"with_joined": "true"}, headers=headers)
+    all_servers = _json_or(browse_resp, [])
+    # The sidebar's joined servers are the flagged ones
+    servers = [s for s in all_servers if s["joined"]]
 
     return render_template("dashboard.html", servers=servers, all_servers=all_servers, username=session.get("username"))
 
@@ -102,11 +123,10 @@ def create_server():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
     name = request.form["name"]
 
-    req.post(f"{API_URL}/servers/", json={"name": name}, headers=headers)
+    api_session.post(f"{API_URL}/servers/", json={"name": name}, headers=headers)
     return redirect(url_for("dashboard"))
 
 
@@ -115,9 +135,8 @@ def join_server(server_id):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
-    req.post(f"{API_URL}/servers/{server_id}/join", headers=headers)
+    api_session.post(f"{API_URL}/servers/{server_id}/join", headers=headers)
     return redirect(url_for("server_page", server_id=server_id))
 
 
@@ -126,16 +145,12 @@ def server_page(server_id):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    # Get all user servers for the sidebar
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
-
-    # Get channels for this server
-    channels_resp = req.get(f"{API_URL}/servers/{server_id}/channels/", headers=headers)
-    channels = channels_resp.json() if channels_resp.status_code == 200 else []
+    # User servers for the sidebar and channels for this server
+    servers_resp, channels_resp = _get_all(headers, "/servers/", f"/servers/{server_id}/channels/")
+    servers = _json_or(servers_resp, [])
+    channels = _json_or(channels_resp, [])
 
     # Find current server name
     current_server = next((s for s in servers if s["id"] == server_id), None)
@@ -155,11 +170,10 @@ def create_channel(server_id):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
     name = request.form["name"]
 
-    req.post(f"{API_URL}/servers/{server_id}/channels/", json={"name": name}, headers=headers)
+    api_session.post(f"{API_URL}/servers/{server_id}/channels/", json={"name": name}, headers=headers)
     return redirect(url_for("server_page", server_id=server_id))
 
 
@@ -168,23 +182,18 @@ def channel_page(server_id, channel_id):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    # Get all user servers for the sidebar
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
-
-    # Get channels for this server
-    channels_resp = req.get(f"{API_URL}/servers/{server_id}/channels/", headers=headers)
-    channels = channels_resp.json() if channels_resp.status_code == 200 else []
-
-    # Get messages for this channel
-    messages_resp = req.get(
-        f"{API_URL}/servers/{server_id}/channels/{channel_id}/messages/",
-        headers=headers,
+    # Sidebar servers, this server's channels and this channel's messages
+    servers_resp, channels_resp, messages_resp = _get_all(
+        headers,
+        "/servers/",
+        f"/servers/{server_id}/channels/",
+        f"/servers/{server_id}/channels/{channel_id}/messages/",
     )
-    messages = messages_resp.json() if messages_resp.status_code == 200 else []
+    servers = _json_or(servers_resp, [])
+    channels = _json_or(channels_resp, [])
+    messages = _json_or(messages_resp, [])
 
     current_server = next((s for s in servers if s["id"] == server_id), None)
     current_channel = next((c for c in channels if c["id"] == channel_id), None)
@@ -215,24 +224,16 @@ def dms_page():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    # Get user's servers for sidebar
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
-
-    # Get friends with status and unread counts (replaces old all-users fetch)
-    friends_resp = req.get(f"{API_URL}/dms/users", headers=headers)
-    friends = friends_resp.json() if friends_resp.status_code == 200 else []
-
-    # Get incoming friend requests
-    incoming_resp = req.get(f"{API_URL}/friends/requests/incoming", headers=headers)
-    incoming_requests = incoming_resp.json() if incoming_resp.status_code == 200 else []
-
-    # Get outgoing friend requests
-    outgoing_resp = req.get(f"{API_URL}/friends/requests/outgoing", headers=headers)
-    outgoing_requests = outgoing_resp.json() if outgoing_resp.status_code == 200 else []
+    # Sidebar servers, friends with status and unread counts, and pending friend requests
+    servers_resp, friends_resp, incoming_resp, outgoing_resp = _get_all(
+        headers, "/servers/", "/dms/users", "/friends/requests/incoming", "/friends/requests/outgoing",
+    )
+    servers = _json_or(servers_resp, [])
+    friends = _json_or(friends_resp, [])
+    incoming_requests = _json_or(incoming_resp, [])
+    outgoing_requests = _json_or(outgoing_resp, [])
 
     return render_template(
         "dms.html",
@@ -251,16 +252,15 @@ def start_dm():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
     target_username = request.form["username"]
 
-    resp = req.post(f"{API_URL}/dms/", json={"username": target_username}, headers=headers)
+    resp = api_session.post(f"{API_URL}/dms/", json={"username": target_username}, headers=headers)
     if resp.status_code in (200, 201):
-        convo = resp.json()
+        convo = orjson.loads(resp.content)
         return redirect(url_for("dm_chat_page", conversation_id=convo["id"]))
     else:
-        flash(resp.json().get("detail", "Could not start DM"), "error")
+        flash(orjson.loads(resp.content).get("detail", "Could not start DM"), "error")
         return redirect(url_for("dms_page"))
 
 
@@ -269,23 +269,18 @@ def dm_chat_page(conversation_id):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    # Servers for sidebar
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
-
-    # Get friends with status and unread counts for DM sidebar
-    friends_resp = req.get(f"{API_URL}/dms/users", headers=headers)
-    friends = friends_resp.json() if friends_resp.status_code == 200 else []
-
-    # Messages for this conversation
-    msgs_resp = req.get(f"{API_URL}/dms/{conversation_id}/messages", headers=headers)
-    messages = msgs_resp.json() if msgs_resp.status_code == 200 else []
+    # Sidebar servers, friends for the DM sidebar and this conversation's messages
+    servers_resp, friends_resp, msgs_resp = _get_all(
+        headers, "/servers/", "/dms/users", f"/dms/{conversation_id}/messages",
+    )
+    servers = _json_or(servers_resp, [])
+    friends = _json_or(friends_resp, [])
+    messages = _json_or(msgs_resp, [])
 
     # Mark this conversation as read
-    req.post(f"{API_URL}/dms/{conversation_id}/read", headers=headers)
+    api_session.post(f"{API_URL}/dms/{conversation_id}/read", headers=headers)
 
     # Find the friend info for the current conversation
     current_friend = next((f for f in friends if f.get("conversation_id") == conversation_id), None)
@@ -300,8 +295,8 @@ def dm_chat_page(conversation_id):
         }
     else:
         # Fallback: fetch conversations list to find the other user
-        convos_resp = req.get(f"{API_URL}/dms/", headers=headers)
-        conversations = convos_resp.json() if convos_resp.status_code == 200 else []
+        convos_resp = api_session.get(f"{API_URL}/dms/", headers=headers)
+        conversations = _json_or(convos_resp, [])
         current_convo = next((c for c in conversations if c["id"] == conversation_id), None)
 
     return render_template(
@@ -324,36 +319,32 @@ def settings():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
     if request.method == "POST":
         # Update display name
         display_name = request.form.get("display_name", "").strip()
-        req.put(f"{API_URL}/auth/profile", json={"display_name": display_name or None}, headers=headers)
+        api_session.put(f"{API_URL}/auth/profile", json={"display_name": display_name or None}, headers=headers)
 
         # Upload avatar if provided
         avatar_file = request.files.get("avatar")
         if avatar_file and avatar_file.filename:
-            resp = req.post(
+            resp = api_session.post(
                 f"{API_URL}/auth/avatar",
                 headers=headers,
                 files={"file": (avatar_file.filename, avatar_file.stream, avatar_file.content_type)}, 
             )
             if resp.status_code != 200:
-                flash(resp.json().get("detail", "Avatar upload failed"), "error")
+                flash(orjson.loads(resp.content).get("detail", "Avatar upload failed"), "error")
                 return redirect(url_for("settings"))
 
         flash("Profile updated!", "success")
         return redirect(url_for("settings"))
 
-    # GET: fetch current profile
-    profile_resp = req.get(f"{API_URL}/auth/profile", headers=headers)
-    profile = profile_resp.json() if profile_resp.status_code == 200 else {}
-
-    # Get servers for sidebar
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
+    # GET: current profile and servers for sidebar
+    profile_resp, servers_resp = _get_all(headers, "/auth/profile", "/servers/")
+    profile = _json_or(profile_resp, {})
+    servers = _json_or(servers_resp, [])
 
     return render_template(
         "settings.html",
@@ -369,23 +360,21 @@ def friends_page():
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    servers_resp = req.get(f"{API_URL}/servers/", headers=headers)
-    servers = servers_resp.json() if servers_resp.status_code == 200 else []
-
-    friends_resp = req.get(f"{API_URL}/friends/", headers=headers)
-    friends = friends_resp.json() if friends_resp.status_code == 200 else []
-
-    incoming_resp = req.get(f"{API_URL}/friends/requests/incoming", headers=headers)
-    incoming = incoming_resp.json() if incoming_resp.status_code == 200 else []
-
-    outgoing_resp = req.get(f"{API_URL}/friends/requests/outgoing", headers=headers)
-    outgoing = outgoing_resp.json() if outgoing_resp.status_code == 200 else []
-
-    blocked_resp = req.get(f"{API_URL}/friends/blocked", headers=headers)
-    blocked = blocked_resp.json() if blocked_resp.status_code == 200 else []
+    servers_resp, friends_resp, incoming_resp, outgoing_resp, blocked_resp = _get_all(
+        headers,
+        "/servers/",
+        "/friends/",
+        "/friends/requests/incoming",
+        "/friends/requests/outgoing",
+        "/friends/blocked",
+    )
+    servers = _json_or(servers_resp, [])
+    friends = _json_or(friends_resp, [])
+    incoming = _json_or(incoming_resp, [])
+    outgoing = _json_or(outgoing_resp, [])
+    blocked = _json_or(blocked_resp, [])
 
     return render_template(
         "friends.html",
@@ -405,24 +394,23 @@ def invite_page(code):
     if "token" not in session:
         return redirect(url_for("login"))
 
-    import requests as req
     headers = {"Authorization": f"Bearer {session['token']}"}
 
-    info_resp = req.get(f"{API_URL}/invites/info/{code}", headers=headers)
+    info_resp = api_session.get(f"{API_URL}/invites/info/{code}", headers=headers)
     if info_resp.status_code != 200:
         flash("Invalid or expired invite", "error")
         return redirect(url_for("dashboard"))
 
-    invite = info_resp.json()
+    invite = orjson.loads(info_resp.content)
 
     # Auto-join
-    join_resp = req.post(f"{API_URL}/invites/join", json={"code": code}, headers=headers)
+    join_resp = api_session.post(f"{API_URL}/invites/join", json={"code": code}, headers=headers)
     if join_resp.status_code == 200:
-        server = join_resp.json()
+        server = orjson.loads(join_resp.content)
         return redirect(url_for("server_page", server_id=server["id"]))
     else:
         try:
-            error = join_resp.json().get("detail", "Could not join server")
+            error = orjson.loads(join_resp.content).get("detail", "Could not join server")
         except Exception:
             error = "Could not join server"
         flash(error, "error")
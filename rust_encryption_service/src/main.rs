@@ -9,11 +9,11 @@ use rand::RngCore;
 use serde::{Deserialize, Serialize};
 use sha2::{Digest, Sha256};
 use std::collections::HashMap;
-use std::sync::Mutex;
+use std::sync::{Arc, RwLock};
 
-// ── App state: holds per-channel encryption keys ──
+// ── App state: holds per-channel ciphers (key already derived and expanded) ──
 struct AppState {
-    keys: Mutex<HashMap<i64, Vec<u8>>>,
+    ciphers: RwLock<HashMap<i64, Arc<Aes256Gcm>>>,
     master_secret: String,
 }
 
@@ -41,6 +41,29 @@ struct DecryptResponse {
     message: String,
 }
 
+#[derive(Deserialize)]
+struct EncryptBatchRequest {
+    channel_id: i64,
+    messages: Vec<String>,
+}
+
+#[derive(Serialize)]
+struct EncryptBatchResponse {
+    encrypted: Vec<String>,
+}
+
+#[derive(Deserialize)]
+struct DecryptBatchRequest {
+    channel_id: i64,
+    encrypted: Vec<String>,
+}
+
+// Entries that fail to decrypt come back as null so one bad row doesn't fail the batch
+#[derive(Serialize)]
+struct DecryptBatchResponse {
+    messages: Vec<Option<String>>,
+}
+
 #[derive(Serialize)]
 struct ErrorResponse {
     error: String,
@@ -54,12 +77,45 @@ fn derive_channel_key(master_secret: &str, channel_id: i64) -> Vec<u8> {
     hasher.finalize().to_vec()
 }
 
-// ── Get or create the key for a channel ──
-fn get_or_create_key(state: &AppState, channel_id: i64) -> Vec<u8> {
-    let mut keys = state.keys.lock().unwrap();
-    keys.entry(channel_id)
-        .or_insert_with(|| derive_channel_key(&state.master_secret, channel_id))
-        .clone()
+// ── Get or create the cipher for a channel ──
+// Cached so the SHA-256 derivation and AES key schedule run once per channel,
+// and a read lock keeps concurrent workers from serializing on cache hits.
+fn get_or_create_cipher(state: &AppState, channel_id: i64) -> Option<Arc<Aes256Gcm>> {
+    if let Some(cipher) = state.ciphers.read().unwrap().get(&channel_id) {
+        return Some(Arc::clone(cipher));
+    }
+    let key_bytes = derive_channel_key(&state.master_secret, channel_id);
+    let cipher = Arc::new(Aes256Gcm::new_from_slice(&key_bytes).ok()?);
+    let mut ciphers = state.ciphers.write().unwrap();
+    Some(Arc::clone(ciphers.entry(channel_id).or_insert(cipher)))
+}
+
+// ── Encrypt one message, packed as base64(nonce + ciphertext) ──
+fn seal(cipher: &Aes256Gcm, plaintext: &str) -> Result<String, aes_gcm::Error> {
+    // Generate a random 12-byte nonce
+    let mut nonce_bytes = [0u8; 12];
+    OsRng.fill_bytes(&mut nonce_bytes);
+    let nonce = Nonce::from_slice(&nonce_bytes);
+
+    let ciphertext = cipher.encrypt(nonce, plaintext.as_bytes())?;
+    let mut combined = nonce_bytes.to_vec();
+    combined.extend_from_slice(&ciphertext);
+    Ok(BASE64.encode(&combined))
+}
+
+// ── Decrypt one base64(nonce + ciphertext) payload ──
+fn open(cipher: &Aes256Gcm, encoded: &str) -> Result<String, &'static str> {
+    let combined = BASE64.decode(encoded).map_err(|_| "Invalid base64")?;
+    if combined.len() < 12 {
+        return Err("Ciphertext too short");
+    }
+
+    // Split nonce (first 12 bytes) from ciphertext
+    let (nonce_bytes, ciphertext) = combined.split_at(12);
+    let nonce = Nonce::from_slice(nonce_bytes);
+
+    let plaintext = cipher.decrypt(nonce, ciphertext).map_err(|_| "Decryption failed")?;
+    Ok(String::from_utf8_lossy(&plaintext).to_string())
 }
 
 // ── POST /encrypt ──
@@ -67,29 +123,17 @@ async fn encrypt(
     data: web::Data<AppState>,
     body: web::Json<EncryptRequest>,
 ) -> HttpResponse {
-    let key_bytes = get_or_create_key(&data, body.channel_id);
-
-    let cipher = match Aes256Gcm::new_from_slice(&key_bytes) {
-        Ok(c) => c,
-        Err(e) => {
-            log::error!("Failed to create cipher: {}", e);
+    let cipher = match get_or_create_cipher(&data, body.channel_id) {
+        Some(c) => c,
+        None => {
+            log::error!("Failed to create cipher for channel {}", body.channel_id);
             return HttpResponse::InternalServerError()
                 .json(ErrorResponse { error: "Encryption init failed".into() });
         }
     };
 
-    // Generate a random 12-byte nonce
-    let mut nonce_bytes = [0u8; 12];
-    OsRng.fill_bytes(&mut nonce_bytes);
-    let nonce = Nonce::from_slice(&nonce_bytes);
-
-    match cipher.encrypt(nonce, body.message.as_bytes()) {
-        Ok(ciphertext) => {
-            // Pack as: base64(nonce + ciphertext)
-            let mut combined = nonce_bytes.to_vec();
-            combined.extend_from_slice(&ciphertext);
-            let encoded = BASE64.encode(&combined);
-
+    match seal(&cipher, &body.message) {
+        Ok(encoded) => {
             log::info!("Encrypted message for channel {}", body.channel_id);
             HttpResponse::Ok().json(EncryptResponse { encrypted: encoded })
         }
@@ -106,47 +150,85 @@ async fn decrypt(
     data: web::Data<AppState>,
     body: web::Json<DecryptRequest>,
 ) -> HttpResponse {
-    let key_bytes = get_or_create_key(&data, body.channel_id);
-
-    let cipher = match Aes256Gcm::new_from_slice(&key_bytes) {
-        Ok(c) => c,
-        Err(e) => {
-            log::error!("Failed to create cipher: {}", e);
+    let cipher = match get_or_create_cipher(&data, body.channel_id) {
+        Some(c) => c,
+        None => {
+            log::error!("Failed to create cipher for channel {}", body.channel_id);
             return HttpResponse::InternalServerError()
                 .json(ErrorResponse { error: "Decryption init failed".into() });
         }
     };
 
-    let combined = match BASE64.decode(&body.encrypted) {
-        Ok(d) => d,
+    match open(&cipher, &body.encrypted) {
+        Ok(message) => {
+            log::info!("Decrypted message for channel {}", body.channel_id);
+            HttpResponse::Ok().json(DecryptResponse { message })
+        }
         Err(e) => {
-            log::error!("Base64 decode failed: {}", e);
-            return HttpResponse::BadRequest()
-                .json(ErrorResponse { error: "Invalid base64".into() });
+            log::error!("Decryption failed: {}", e);
+            HttpResponse::BadRequest().json(ErrorResponse { error: e.into() })
+        }
+    }
+}
+
+// ── POST /encrypt_batch ──
+async fn encrypt_batch(
+    data: web::Data<AppState>,
+    body: web::Json<EncryptBatchRequest>,
+) -> HttpResponse {
+    let cipher = match get_or_create_cipher(&data, body.channel_id) {
+        Some(c) => c,
+        None => {
+            log::error!("Failed to create cipher for channel {}", body.channel_id);
+            return HttpResponse::InternalServerError()
+                .json(ErrorResponse { error: "Encryption init failed".into() });
         }
     };
 
-    if combined.len() < 12 {
-        return HttpResponse::BadRequest()
-            .json(ErrorResponse { error: "Ciphertext too short".into() });
+    let mut encrypted = Vec::with_capacity(body.messages.len());
+    for message in &body.messages {
+        match seal(&cipher, message) {
+            Ok(encoded) => encrypted.push(encoded),
+            Err(e) => {
+                log::error!("Encryption failed: {}", e);
+                return HttpResponse::InternalServerError()
+                    .json(ErrorResponse { error: "Encryption failed".into() });
+            }
+        }
     }
 
-    // Split nonce (first 12 bytes) from ciphertext
-    let (nonce_bytes, ciphertext) = combined.split_at(12);
-    let nonce = Nonce::from_slice(nonce_bytes);
+    log::info!("Encrypted {} messages for channel {}", encrypted.len(), body.channel_id);
+    HttpResponse::Ok().json(EncryptBatchResponse { encrypted })
+}
 
-    match cipher.decrypt(nonce, ciphertext) {
-        Ok(plaintext) => {
-            let message = String::from_utf8_lossy(&plaintext).to_string();
-            log::info!("Decrypted message for channel {}", body.channel_id);
-            HttpResponse::Ok().json(DecryptResponse { message })
-        }
-        Err(e) => {
-            log::error!("Decryption failed: {}", e);
-            HttpResponse::BadRequest()
-                .json(ErrorResponse { error: "Decryption failed".into() })
+// ── POST /decrypt_batch ──
+async fn decrypt_batch(
+    data: web::Data<AppState>,
+    body: web::Json<DecryptBatchRequest>,
+) -> HttpResponse {
+    let cipher = match get_or_create_cipher(&data, body.channel_id) {
+        Some(c) => c,
+        None => {
+            log::error!("Failed to create cipher for channel {}", body.channel_id);
+            return HttpResponse::InternalServerError()
+                .json(ErrorResponse { error: "Decryption init failed".into() });
         }
-    }
+    };
+
+    let messages: Vec<Option<String>> = body
+        .encrypted
+        .iter()
+        .map(|encoded| match open(&cipher, encoded) {
+            Ok(message) => Some(message),
+            Err(e) => {
+                log::error!("Decryption failed: {}", e);
+                None
+            }
+        })
+        .collect();
+
+    log::info!("Decrypted {} messages for channel {}", messages.len(), body.channel_id);
+    HttpResponse::Ok().json(DecryptBatchResponse { messages })
 }
 
 // ── Health check ──
@@ -165,7 +247,7 @@ async fn main() -> std::io::Result<()> {
     log::info!("Starting encryption service on port 8001");
 
     let state = web::Data::new(AppState {
-        keys: Mutex::new(HashMap::new()),
+        ciphers: RwLock::new(HashMap::new()),
         master_secret,
     });
 
@@ -179,6 +261,8 @@ async fn main() -> std::io::Result<()> {
             .route("/health", web::get().to(health))
             .route("/encrypt", web::post().to(encrypt))
             .route("/decrypt", web::post().to(decrypt))
+            .route("/encrypt_batch", web::post().to(encrypt_batch))
+            .route("/decrypt_batch", web::post().to(decrypt_batch))
     })
     .bind("127.0.0.1:8001")?
     .run()